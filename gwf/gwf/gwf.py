@@ -3,24 +3,266 @@ import numpy as np
 import matplotlib.pyplot as plt
 import datetime
 import os
+import mmap
+
+default_write_buffer_size = 4 * 1024**2
 
 class File:
-    def __init__(self, path):
+    index_extension = '.idx'
+
+    def __init__(self, path, mmap=False):
         self.path = path
+        self.index_path = path + self.index_extension
         self.fin = None
+        self.use_mmap = mmap
+        self._buffer = None
+        self._index = None
+        self._index_file_state = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # Pings handed out in mmap mode keep their own reference to the mapping, the mapping is unmapped once the last of them is gone
+        self._buffer = None
 
-    def write(self, ping_generator):
-        with open(self.path, 'wb') as f:
+    def write(self, ping_generator, buffer_size = default_write_buffer_size, use_writev = True):
+        self.close()
+        with Writer(self.path, buffer_size, use_writev) as writer:
             for ping in ping_generator:
-                p = GenericWaterColumnPing.from_ping(ping)
-                bytes_written = f.write(p.serialize())
+                writer.write(ping)
+        self._index = None
 
     def read(self):
+        if self.use_mmap:
+            buffer = self._map()
+            offset = 0
+            while offset < len(buffer):
+                ping = GenericWaterColumnPing.from_buffer(buffer, offset)
+                offset += ping.size
+                yield ping
+            return
+
         with open(self.path, 'rb') as f:
             file_size = os.path.getsize(self.path)
             while f.tell() < file_size:
                 yield GenericWaterColumnPing.from_file(f)
 
+    def index(self):
+        # The index is validated against the size and modification time of the data file, so a stale sidecar file is rebuilt rather than trusted
+        stat = os.stat(self.path)
+        file_state = (stat.st_size, stat.st_mtime_ns)
+        if self._index is None or self._index_file_state != file_state:
+            self._index = PingIndex.load(self.index_path, *file_state)
+            if self._index is None:
+                self._index = self._build_index()
+                try:
+                    self._index.save(self.index_path, *file_state)
+                except OSError:
+                    # Not being able to store the index (e.g. read-only corpus) only costs us a rebuild next time
+                    pass
+            self._index_file_state = file_state
+        return self._index
+
+    def read_ping(self, ping_number):
+        entry = self.index().find(ping_number)
+        if self.use_mmap:
+            return GenericWaterColumnPing.from_buffer(self._map(), int(entry['file_offset']))
+
+        with open(self.path, 'rb') as f:
+            f.seek(int(entry['file_offset']))
+            return GenericWaterColumnPing.from_file(f)
+
+    def read_range(self, start_time, end_time):
+        entries = self.index().in_range(start_time, end_time)
+        if self.use_mmap:
+            buffer = self._map()
+            for entry in entries:
+                yield GenericWaterColumnPing.from_buffer(buffer, int(entry['file_offset']))
+            return
+
+        with open(self.path, 'rb') as f:
+            for entry in entries:
+                f.seek(int(entry['file_offset']))
+                yield GenericWaterColumnPing.from_file(f)
+
+    def __len__(self):
+        return len(self.index())
+
+    def _map(self):
+        if self._buffer is None:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # mmap refuses to map empty files
+                    self._buffer = memoryview(b'')
+                else:
+                    self._buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._buffer
+
+    def scan_headers(self):
+        # Returns an array with PingIndex.entry_dtype holding the header fields, offset and size of every ping in the file. Only ping and beam headers are touched, samples are skipped
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return np.zeros(0, dtype=PingIndex.entry_dtype)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return self._scan_headers(buffer)
+
+    @staticmethod
+    def _scan_headers(buffer):
+        ping_header = struct.Struct(GenericWaterColumnPing.header_struct)
+        beam_header = struct.Struct(GenericWaterColumnBeam.beam_header_struct)
+        entries = []
+        offset = 0
+        end = len(buffer)
+        while offset < end:
+            ping_offset = offset
+            header = ping_header.unpack_from(buffer, offset)
+            number_of_beams = header[3]
+            offset += ping_header.size + header[6]
+            for beam in range(number_of_beams):
+                amplitude_sample_size, phase_sample_size, generic_data_size = beam_header.unpack_from(buffer, offset)
+                offset += beam_header.size + amplitude_sample_size + phase_sample_size + generic_data_size
+            entries.append((header[0], header[1], header[2], number_of_beams, ping_offset, offset - ping_offset))
+        return np.array(entries, dtype=PingIndex.entry_dtype)
+
+    def _build_index(self):
+        return PingIndex(self.scan_headers())
+
+def write_atomically(path, parts):
+    # Written next to path and moved into place, so an interrupted or concurrent write never leaves a partial file behind
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary_path, 'wb') as f:
+            for part in parts:
+                f.write(part)
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
+
+class PingIndex:
+    magic = b'GWFI'
+    version = 2
+    header_struct = '<4sIQQQ' # magic, version, size of the indexed file, modification time of the indexed file (ns), number of entries
+    entry_dtype = np.dtype([('ping_number', '<u4'),
+                            ('ping_time_seconds', '<u4'),
+                            ('ping_time_micro_seconds', '<u4'),
+                            ('number_of_beams', '<u2'),
+                            ('file_offset', '<u8'),
+                            ('size', '<u4')])
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.times = entries['ping_time_seconds'] + entries['ping_time_micro_seconds'] / 1E6
+        self.positions = {}
+        for position, ping_number in enumerate(entries['ping_number'].tolist()):
+            self.positions.setdefault(ping_number, position)
+
+    @classmethod
+    def load(cls, path, file_size, file_modification_time):
+        try:
+            with open(path, 'rb') as f:
+                header = struct.unpack(cls.header_struct, f.read(struct.calcsize(cls.header_struct)))
+                if header[:4] != (cls.magic, cls.version, file_size, file_modification_time):
+                    return None
+                entries = np.frombuffer(f.read(), dtype=cls.entry_dtype)
+        except (OSError, struct.error, ValueError):
+            return None
+        # Pings are stored back to back, so a complete index ends exactly at the end of the file
+        if len(entries) != header[4] or (len(entries) > 0 and int(entries['file_offset'][-1]) + int(entries['size'][-1]) != file_size):
+            return None
+        return cls(entries)
+
+    def save(self, path, file_size, file_modification_time):
+        write_atomically(path, [struct.pack(self.header_struct, self.magic, self.version, file_size, file_modification_time, len(self.entries)), self.entries.tobytes()])
+
+    def find(self, ping_number):
+        return self.entries[self.positions[ping_number]]
+
+    def in_range(self, start_time, end_time):
+        return self.entries[(self.times >= start_time) & (self.times < end_time)]
+
+    def __len__(self):
+        return len(self.entries)
+
+class Writer:
+    # Streaming GWF writer. Serialized pings are collected until buffer_size bytes are pending and then handed to the OS in one
+    # (vectored) write. The ping index is built while writing and stored next to the file on close.
+    def __init__(self, path, buffer_size = default_write_buffer_size, use_writev = True, build_index = True):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.use_writev = use_writev and hasattr(os, 'writev')
+        self.build_index = build_index
+        self.file = open(path, 'wb', buffering=0)
+        self.pending = []
+        self.pending_size = 0
+        self.offset = 0
+        self.index_entries = []
+        self.writev_batch_size = os.sysconf('SC_IOV_MAX') if self.use_writev else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, ping):
+        if not isinstance(ping, GenericWaterColumnPing):
+            ping = GenericWaterColumnPing.from_ping(ping)
+
+        buffer = bytearray(ping.serialized_size())
+        ping.serialize_into(buffer)
+        if self.build_index:
+            self.index_entries.append((ping.ping_number, ping.ping_time_seconds, ping.ping_time_micro_seconds, len(ping.beams), self.offset, len(buffer)))
+        self.offset += len(buffer)
+
+        self.pending.append(buffer)
+        self.pending_size += len(buffer)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+        return len(buffer)
+
+    def flush(self):
+        if self.use_writev:
+            self._writev([memoryview(buffer) for buffer in self.pending])
+        elif self.pending:
+            self._write(memoryview(b''.join(self.pending)))
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.flush()
+        self.file.close()
+        if self.build_index:
+            stat = os.stat(self.path)
+            index = PingIndex(np.array(self.index_entries, dtype=PingIndex.entry_dtype))
+            index.save(self.path + File.index_extension, stat.st_size, stat.st_mtime_ns)
+
+    def _write(self, view):
+        # Raw file objects are allowed to write less than requested
+        while len(view) > 0:
+            view = view[self.file.write(view):]
+
+    def _writev(self, views):
+        fd = self.file.fileno()
+        first = 0
+        while first < len(views):
+            bytes_written = os.writev(fd, views[first:first + self.writev_batch_size])
+            while first < len(views) and bytes_written >= len(views[first]):
+                bytes_written -= len(views[first])
+                first += 1
+            if bytes_written > 0:
+                views[first] = views[first][bytes_written:]
+
 class GenericWaterColumnBeam:
     beam_header_struct = '<IIH'
 
@@ -47,9 +289,38 @@ class GenericWaterColumnBeam:
         generic_data = f.read(generic_data_size)
         return cls(amplitude_samples, phase_samples, generic_data)
 
+    @classmethod
+    def from_buffer(cls, buffer, offset):
+        # Returns the beam and the offset of the first byte after it. Samples are views into buffer, not copies
+        header = struct.unpack_from(cls.beam_header_struct, buffer, offset)
+        offset += struct.calcsize(cls.beam_header_struct)
+        amplitude_samples = buffer[offset:offset + header[0]]
+        offset += header[0]
+        phase_samples = buffer[offset:offset + header[1]]
+        offset += header[1]
+        generic_data = buffer[offset:offset + header[2]]
+        offset += header[2]
+        return cls(amplitude_samples, phase_samples, generic_data), offset
+
+    def copy(self):
+        return GenericWaterColumnBeam(bytes(self.amplitude_samples), bytes(self.phase_samples), bytes(self.generic_data))
+
+    def serialized_size(self):
+        return struct.calcsize(self.beam_header_struct) + len(self.amplitude_samples) + len(self.phase_samples) + len(self.generic_data)
+
+    def serialize_into(self, buffer, offset):
+        # Returns the offset of the first byte after the beam
+        struct.pack_into(self.beam_header_struct, buffer, offset, len(self.amplitude_samples), len(self.phase_samples), len(self.generic_data))
+        offset += struct.calcsize(self.beam_header_struct)
+        for data in (self.amplitude_samples, self.phase_samples, self.generic_data):
+            buffer[offset:offset + len(data)] = data
+            offset += len(data)
+        return offset
+
     def serialize(self):
-        header = struct.pack(self.beam_header_struct, len(self.amplitude_samples), len(self.phase_samples), len(self.generic_data))
-        return header + self.amplitude_samples + self.phase_samples + self.generic_data
+        buffer = bytearray(self.serialized_size())
+        self.serialize_into(buffer, 0)
+        return bytes(buffer)
 
 class GenericWaterColumnPing:
     header_struct = '<IIIHBBH'
@@ -99,50 +370,90 @@ class GenericWaterColumnPing:
         size = f.tell() - file_offset
         return cls(ping_number, ping_time_seconds, ping_time_micro_seconds, amplitude_sample_format, phase_sample_format, generic_data, beams, file_offset, size)
 
-    def serialize(self):
-        header = struct.pack(self.header_struct, self.ping_number, self.ping_time_seconds, self.ping_time_micro_seconds, len(self.beams), self.amplitude_sample_format, self.phase_sample_format, len(self.generic_data))
-        serialized = header + self.generic_data
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        # Same as from_file, but generic data and beam samples are memoryview slices of buffer. Use copy() to detach the ping from the buffer
+        buffer = memoryview(buffer)
+        file_offset = offset
+        header = struct.unpack_from(cls.header_struct, buffer, offset)
+        offset += struct.calcsize(cls.header_struct)
+        ping_number = header[0]
+        ping_time_seconds = header[1]
+        ping_time_micro_seconds = header[2]
+        number_of_beams = header[3]
+        amplitude_sample_format = header[4]
+        phase_sample_format = header[5]
+        generic_data_size = header[6]
+        generic_data = buffer[offset:offset + generic_data_size]
+        offset += generic_data_size
+        beams = []
+        for beam in range(number_of_beams):
+            beam, offset = GenericWaterColumnBeam.from_buffer(buffer, offset)
+            beams.append(beam)
+
+        size = offset - file_offset
+        return cls(ping_number, ping_time_seconds, ping_time_micro_seconds, amplitude_sample_format, phase_sample_format, generic_data, beams, file_offset, size)
+
+    def copy(self):
+        return GenericWaterColumnPing(self.ping_number, self.ping_time_seconds, self.ping_time_micro_seconds, self.amplitude_sample_format, self.phase_sample_format, bytes(self.generic_data), [beam.copy() for beam in self.beams], self.file_offset, self.size)
+
+    def serialized_size(self):
+        return struct.calcsize(self.header_struct) + len(self.generic_data) + sum(beam.serialized_size() for beam in self.beams)
+
+    def serialize_into(self, buffer, offset = 0):
+        # Writes the ping into a preallocated, writable buffer of at least serialized_size() bytes past offset and returns the offset of the first byte after the ping
+        struct.pack_into(self.header_struct, buffer, offset, self.ping_number, self.ping_time_seconds, self.ping_time_micro_seconds, len(self.beams), self.amplitude_sample_format, self.phase_sample_format, len(self.generic_data))
+        offset += struct.calcsize(self.header_struct)
+        buffer[offset:offset + len(self.generic_data)] = self.generic_data
+        offset += len(self.generic_data)
         for beam in self.beams:
-            serialized += beam.serialize()
-        return serialized
+            offset = beam.serialize_into(buffer, offset)
+        return offset
+
+    def serialize(self):
+        buffer = bytearray(self.serialized_size())
+        self.serialize_into(buffer)
+        # Callers (e.g. ctypes based codecs) rely on getting immutable bytes
+        return bytes(buffer)
+
+    sample_formats = {0: 'b', 1: 'B', 2: 'h', 3: 'H', 4: 'i', 5: 'I'}
 
     def get_sample_format_as_struct_format_specifier(self):
-        if self.amplitude_sample_format == 0:
-            return 'b'
-        elif self.amplitude_sample_format == 1:
-            return 'B'
-        if self.amplitude_sample_format == 2:
-            return 'h'
-        elif self.amplitude_sample_format == 3:
-            return 'H'
-        elif self.amplitude_sample_format == 4:
-            return 'i'
-        elif self.amplitude_sample_format == 5:
-            return 'I'
-        else:
+        return self.sample_dtype(self.amplitude_sample_format).char
+
+    @classmethod
+    def sample_dtype(cls, sample_format):
+        if sample_format not in cls.sample_formats:
             raise ValueError("We don't support all formats yet")
+        return np.dtype('<' + cls.sample_formats[sample_format])
 
-    def ampltidue_array(self, decimate_factor = 1):
-        number_of_samples =  lambda beam: int(len(beam.amplitude_samples) / struct.calcsize(self.get_sample_format_as_struct_format_specifier()))
-        beam_samples = [struct.unpack('<{count}{format}'.format(count=number_of_samples(beam),format=self.get_sample_format_as_struct_format_specifier()), beam.amplitude_samples) for beam in self.beams]
+    def amplitude_array(self, decimate_factor = 1):
+        # samples x beams array in the native sample format. Shorter beams are padded with zeros
+        return self._sample_array([beam.amplitude_samples for beam in self.beams], self.sample_dtype(self.amplitude_sample_format), decimate_factor)
 
-        height = max([len(b) for b in beam_samples]) // decimate_factor + 1
-        width = len(beam_samples)
-        array = np.zeros((height, width))
-        for i, samples in enumerate(beam_samples):
-            for j, sample in enumerate(samples):
-                if(j % decimate_factor != 0):
-                    continue
+    def phase_array(self, decimate_factor = 1):
+        return self._sample_array([beam.phase_samples for beam in self.beams], self.sample_dtype(self.phase_sample_format), decimate_factor)
 
-                if self.amplitude_sample_format == 0:
-                    sample += 2**8 / 2
-                elif self.amplitude_sample_format == 2:
-                    sample += 2**16 /2
-                elif self.amplitude_sample_format == 4:
-                    sample += 2**32 /2
+    def _sample_array(self, beam_samples, dtype, decimate_factor):
+        columns = [np.frombuffer(samples, dtype=dtype)[::decimate_factor] for samples in beam_samples]
+        height = max((len(column) for column in columns), default=0)
+        # Filled beam by beam so every copy is contiguous, then returned as a samples x beams view
+        array = np.zeros((len(columns), height), dtype=dtype)
+        for i, column in enumerate(columns):
+            array[i, :len(column)] = column
+        return array.T
 
-                array[j//decimate_factor][i] = sample
+    def ampltidue_array(self, decimate_factor = 1):
+        # float64 version of amplitude_array with signed samples shifted to the unsigned range and one spare row, as used by show()
+        samples = self.amplitude_array(decimate_factor)
+        sample_offsets = {0: 2**8 / 2, 2: 2**16 / 2, 4: 2**32 / 2}
+        number_of_samples = np.array([len(beam.amplitude_samples) // samples.itemsize for beam in self.beams])
 
+        height = max(number_of_samples) // decimate_factor + 1
+        width = len(self.beams)
+        array = np.zeros((height, width))
+        valid = np.arange(samples.shape[0])[:, np.newaxis] < -(-number_of_samples // decimate_factor)
+        array[:samples.shape[0]] = np.where(valid, samples + sample_offsets.get(self.amplitude_sample_format, 0), 0)
         return array
 
     def show(self, decimate_factor = 1):
@@ -1,4 +1,10 @@
 #pragma once
+#include <algorithm>
+#include <cctype>
+#include <cmath>
+#include <memory>
+#include <string>
+#include <vector>
 #include <jasper/jasper.h>
 #include <boost/algorithm/string.hpp>
 #include <boost/format.hpp>
@@ -74,7 +80,7 @@ char* CopySamples(char* dst, const GWF::Beam& beam)
 	auto length = beam.m_AmplitudeData.size();
 	int offset = 0;
 	if(sampleFormatIsSigned(beam.m_amplitudeFormat))
-		offset = static_cast<int>(std::powf(2, formatToNumberOfBytes(beam.m_amplitudeFormat) * 8)) / 2;
+		offset = static_cast<int>(std::pow(2, formatToNumberOfBytes(beam.m_amplitudeFormat) * 8)) / 2;
 
 	switch (beam.m_amplitudeFormat)
 	{
@@ -100,7 +106,7 @@ char* CopySamples(GWF::Beam& beam, const char* src)
 	int offset = 0;
 	if(sampleFormatIsSigned(beam.m_amplitudeFormat))
 	{
-		offset = static_cast<int>(std::powf(2, formatToNumberOfBytes(beam.m_amplitudeFormat) * 8)) / 2;
+		offset = static_cast<int>(std::pow(2, formatToNumberOfBytes(beam.m_amplitudeFormat) * 8)) / 2;
 		offset *= -1;
 	}
 
@@ -137,7 +143,7 @@ std::pair<std::shared_ptr<char>, size_t> WcdSamplesToPgm(const GWF::WaterColumn&
 		max_number_of_sample_bytes = std::max(max_number_of_sample_bytes, wcd.m_Beams[i].m_AmplitudeData.size());
 
 	auto bytes_per_sample = formatToNumberOfBytes(wcd.m_amplitudeFormat);
-	auto max_sample_value = static_cast<int>(std::powf(2, bytes_per_sample * 8) ) -1;
+	auto max_sample_value = static_cast<int>(std::pow(2, bytes_per_sample * 8) ) -1;
 
 	auto width = max_number_of_sample_bytes / bytes_per_sample;
 	auto height = wcd.m_Beams.size();	
@@ -157,7 +163,7 @@ std::pair<std::shared_ptr<char>, size_t> WcdSamplesToPgm(const GWF::WaterColumn&
 		beam_image += max_number_of_sample_bytes;
 	}
 
-	return std::make_pair(std::shared_ptr<char>(image), size);
+	return std::make_pair(std::shared_ptr<char>(image, free), size);
 }
 
 void PgmToWcdSamples(std::pair<std::shared_ptr<char>, size_t> pgm, GWF::WaterColumn& wcd)
@@ -180,7 +186,7 @@ void PgmToWcdSamples(std::pair<std::shared_ptr<char>, size_t> pgm, GWF::WaterCol
 	assert(headerItems.size() >= 4);
 
 	auto bytes_per_sample = formatToNumberOfBytes(wcd.m_amplitudeFormat);
-	auto max_sample_value_according_to_gwc = static_cast<int>(std::powf(2, bytes_per_sample * 8) ) -1;
+	auto max_sample_value_according_to_gwc = static_cast<int>(std::pow(2, bytes_per_sample * 8) ) -1;
 
 	size_t number_of_beams = std::stoi(headerItems[2]);
 	assert(number_of_beams == wcd.m_Beams.size());
@@ -220,7 +226,7 @@ std::pair<std::shared_ptr<char>, size_t> ConvertPgmToJpeg2k(std::pair<std::share
 	jas_stream_close(jpeg2k_stream);
 	jas_image_destroy(pnm_image);
 
-	return std::make_pair(std::shared_ptr<char>(jpeg2k_memory), compressed_size);
+	return std::make_pair(std::shared_ptr<char>(jpeg2k_memory, free), compressed_size);
 }
 
 std::pair<std::shared_ptr<char>, size_t> ConvertJpeg2kToPGM(std::pair<char*, size_t> jp2, size_t uncompressed_size)
@@ -241,6 +247,6 @@ std::pair<std::shared_ptr<char>, size_t> ConvertJpeg2kToPGM(std::pair<char*, siz
 	jas_stream_close(pgm_stream);
 	jas_image_destroy(jp2_image);
 	
-	return std::make_pair(std::shared_ptr<char>(pgm_memory), decompressed_size);
+	return std::make_pair(std::shared_ptr<char>(pgm_memory, free), decompressed_size);
 }
 }
\ No newline at end of file
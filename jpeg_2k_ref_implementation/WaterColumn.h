@@ -1,5 +1,7 @@
 #pragma once
 #include <cstdint>
+#include <cstdlib>
+#include <cstring>
 #include <vector>
 #include "Parsing.hpp"
 #include "types.h"
@@ -76,8 +78,13 @@ namespace GWF
 			auto total_size = GetSerializedSize();
 
 			auto data = (char*)malloc(total_size);
-			auto start = data;
+			auto end = Serialize(data);
+			return std::make_pair(data, end - data);
+		}
 
+		// Serialize into a buffer of at least GetSerializedSize() bytes, returns the end of the serialized data
+		char* Serialize(char* data)
+		{
 			assert(m_pingNumber <= 0xFFFFFFFF);
 			auto pingNumber = static_cast<PING_NUMBER_TYPE>(m_pingNumber);
 			assert(m_Beams.size() <= 0xFFFF);
@@ -100,7 +107,7 @@ namespace GWF
 			for(auto& beam : m_Beams)
 				data = beam.Serialize(data);
 
-			return std::make_pair(start, data - start);
+			return data;
 		}
 
 
@@ -1,5 +1,6 @@
 #pragma once
 #include <cstdint>
+#include <cstring>
 #include <vector>
 #include "Parsing.hpp"
 #include "types.h"
@@ -116,20 +117,21 @@ namespace GWF
 		std::vector<std::uint8_t> m_PhaseData;
 
 	private:
+		// Overloads rather than explicit specializations, which are not allowed at class scope outside of MSVC
 		template<typename T>
 		bool checkType(T* data, sampleFormat format) const
 		{
 			return false;
 		}
 
-		template<> bool checkType(std::uint8_t* data, sampleFormat format) const { return format == sampleFormat::u8; }
-		template<> bool checkType(std::int8_t* data, sampleFormat format) const { return format == sampleFormat::i8; }
-		template<> bool checkType(std::uint16_t* data, sampleFormat format) const { return format == sampleFormat::u16; }
-		template<> bool checkType(std::int16_t* data, sampleFormat format) const { return format == sampleFormat::i16; }
-		template<> bool checkType(std::uint32_t* data, sampleFormat format) const { return format == sampleFormat::u32; }
-		template<> bool checkType(std::int32_t* data, sampleFormat format) const { return format == sampleFormat::i32; }
-		template<> bool checkType(float* data, sampleFormat format) const { return format == sampleFormat::ieee_f32; }
-		template<> bool checkType(double* data, sampleFormat format) const { return format == sampleFormat::ieee_f64; }
+		bool checkType(std::uint8_t* data, sampleFormat format) const { return format == sampleFormat::u8; }
+		bool checkType(std::int8_t* data, sampleFormat format) const { return format == sampleFormat::i8; }
+		bool checkType(std::uint16_t* data, sampleFormat format) const { return format == sampleFormat::u16; }
+		bool checkType(std::int16_t* data, sampleFormat format) const { return format == sampleFormat::i16; }
+		bool checkType(std::uint32_t* data, sampleFormat format) const { return format == sampleFormat::u32; }
+		bool checkType(std::int32_t* data, sampleFormat format) const { return format == sampleFormat::i32; }
+		bool checkType(float* data, sampleFormat format) const { return format == sampleFormat::ieee_f32; }
+		bool checkType(double* data, sampleFormat format) const { return format == sampleFormat::ieee_f64; }
 
 	};
 }
\ No newline at end of file
@@ -69,7 +69,7 @@ static char* WriteGenericPingData(char* dst, const GWF::WaterColumn& wcd);
 static char* WriteGenericBeamData(char* dst, const GWF::Beam& beam);
 static char* WriteBeamPhaseData(char* dst, const GWF::Beam& beam);
 static char* WriteBeamAmplitudeSampleCount(char* dst, const GWF::Beam& beam);
-static char* WriteAmplitudeSamples(char* dst, const GWF::WaterColumn& wcd);
+static char* WriteAmplitudeSamples(char* dst, std::uint32_t uncompressedSize, const std::pair<std::shared_ptr<char>, size_t>& jp2);
 static char* WritePingNumber(char* dst, const GWF::WaterColumn& wcd);
 static char* WritePingTime(char* dst, const GWF::WaterColumn& wcd);
 
@@ -84,15 +84,59 @@ static const char* ReadAmplitudeSamples(const char* src, size_t length, GWF::Wat
 const char * ReadPingNumber(const char * src, std::uint32_t & pingNumber);
 const char * ReadPingTime(const char * src, std::pair<PING_TIME_S_TYPE, PING_TIME_US_TYPE>& pingTime);
 
+static bool IsSupportedAmplitudeFormat(GWF::sampleFormat format);
+static size_t CompressedHeaderSize(const GWF::WaterColumn& wcd);
+
 char* Compress(char* uncompressedData, unsigned int uncompressedDataSize, unsigned int* compressedSize)
 {
-	// Parse the data as generic water column data
-	GWF::WaterColumn wcd(uncompressedData, uncompressedDataSize);
-
 	// Let's assume that we are at least able not to inflate the data. Allocate a buffer equal to the input size
 	auto out_data = (char*)malloc(uncompressedDataSize);
-	auto buffer_start = out_data;
+	auto result = jp2k_compress(uncompressedData, uncompressedDataSize, out_data, uncompressedDataSize, compressedSize);
+	if(result == JP2K_BUFFER_TOO_SMALL)
+	{
+		out_data = (char*)realloc(out_data, *compressedSize);
+		result = jp2k_compress(uncompressedData, uncompressedDataSize, out_data, *compressedSize, compressedSize);
+	}
+
+	if(result != JP2K_OK)
+	{
+		free(out_data);
+		*compressedSize = 0;
+		return nullptr;
+	}
+	return out_data;
+}
+
+char* Decompress(char* compressedData, unsigned int compressedDataSize, unsigned int* decompressedSize)
+{
+	*decompressedSize = jp2k_decompressed_size(compressedData, compressedDataSize);
+	auto out_data = (char*)malloc(*decompressedSize);
+	jp2k_decompress(compressedData, compressedDataSize, out_data, *decompressedSize, decompressedSize);
+	return out_data;
+}
+
+void Destroy(char* data)
+{
+	free(data);
+}
+
+int jp2k_compress(const char* data, unsigned int size, char* output, unsigned int outputCapacity, unsigned int* outputSize)
+{
+	// Parse the data as generic water column data
+	GWF::WaterColumn wcd(data, size);
+	if(!IsSupportedAmplitudeFormat(wcd.m_amplitudeFormat))
+		return JP2K_UNSUPPORTED_SAMPLE_FORMAT;
+
+	// Create a PGM from the sample data, then convert the PGM to a JPEG2k
+	auto pgm = FormatConversion::WcdSamplesToPgm(wcd);
+	auto jp2 = FormatConversion::ConvertPgmToJpeg2k(pgm);
 
+	auto requiredSize = CompressedHeaderSize(wcd) + sizeof(std::uint32_t) + jp2.second;
+	*outputSize = static_cast<unsigned int>(requiredSize);
+	if(requiredSize > outputCapacity)
+		return JP2K_BUFFER_TOO_SMALL;
+
+	auto out_data = output;
 	out_data = WritePingNumber(out_data, wcd);
 	out_data = WritePingTime(out_data, wcd);
 	out_data = WriteAmplitudeFormat(out_data, wcd);
@@ -107,15 +151,22 @@ char* Compress(char* uncompressedData, unsigned int uncompressedDataSize, unsign
 		out_data = WriteBeamAmplitudeSampleCount(out_data, beam);
 	}
 
-	out_data = WriteAmplitudeSamples(out_data, wcd);
-	*compressedSize = static_cast<size_t>(out_data-buffer_start);
-	return buffer_start;
+	// Write the size of the UNCOMPRESSED image
+	std::uint32_t pgmSize = static_cast<std::uint32_t>(pgm.second);
+	assert(pgmSize == pgm.second); // Make sure we don't have an overflow
+	out_data = WriteAmplitudeSamples(out_data, pgmSize, jp2);
+	assert(static_cast<size_t>(out_data - output) == requiredSize);
+	return JP2K_OK;
 }
 
-char* Decompress(char* compressedData, unsigned int compressedDataSize, unsigned int* decompressedSize)
-{	
+int jp2k_decompress(const char* data, unsigned int size, char* output, unsigned int outputCapacity, unsigned int* outputSize)
+{
+	*outputSize = jp2k_decompressed_size(data, size);
+	if(*outputSize > outputCapacity)
+		return JP2K_BUFFER_TOO_SMALL;
+
 	std::uint32_t pingNumber;
-	auto src = ReadPingNumber(compressedData, pingNumber);
+	auto src = ReadPingNumber(data, pingNumber);
 	std::pair<PING_TIME_S_TYPE, PING_TIME_US_TYPE> pingTime;
 	src = ReadPingTime(src, pingTime);
 	GWF::sampleFormat amplitudeFormat;
@@ -136,16 +187,74 @@ char* Decompress(char* compressedData, unsigned int compressedDataSize, unsigned
 		src = ReadBeamAmplitudeSampleCount(src, beam);
 	}
 
-	src = ReadAmplitudeSamples(src, compressedDataSize- (src-compressedData), wcd);
+	src = ReadAmplitudeSamples(src, size - (src - data), wcd);
 
-	auto serialized = wcd.Serialize();
-	*decompressedSize = serialized.second;
-	return serialized.first;
+	wcd.Serialize(output);
+	return JP2K_OK;
 }
 
-void Destroy(char* data)
+unsigned int jp2k_decompressed_size(const char* data, unsigned int size)
+{
+	// Walk the headers of the compressed format, the serialized record holds the same fields plus the amplitude samples
+	std::uint32_t pingNumber;
+	auto src = ReadPingNumber(data, pingNumber);
+	std::pair<PING_TIME_S_TYPE, PING_TIME_US_TYPE> pingTime;
+	src = ReadPingTime(src, pingTime);
+	src += 2 * sizeof(SAMPLE_FORMAT_TYPE);
+
+	NUMBER_OF_BEAMS_TYPE numberOfBeams;
+	src = ParseField(src, numberOfBeams);
+	GENERIC_DATA_SIZE_TYPE genericDataSize;
+	src = ParseField(src, genericDataSize);
+	src += genericDataSize;
+
+	size_t decompressedSize = sizeof(PING_NUMBER_TYPE) + sizeof(PING_TIME_S_TYPE) + sizeof(PING_TIME_US_TYPE) + sizeof(NUMBER_OF_BEAMS_TYPE) +
+		2 * sizeof(SAMPLE_FORMAT_TYPE) + sizeof(GENERIC_DATA_SIZE_TYPE) + genericDataSize;
+	for(auto i = 0u ; i < numberOfBeams ; ++i)
+	{
+		std::uint16_t beamGenericDataSize;
+		src = ParseField(src, beamGenericDataSize);
+		src += beamGenericDataSize;
+		std::uint32_t phaseDataSize;
+		src = ParseField(src, phaseDataSize);
+		src += phaseDataSize;
+		std::uint32_t amplitudeDataSize;
+		src = ParseField(src, amplitudeDataSize);
+		decompressedSize += 2 * sizeof(std::uint32_t) + sizeof(std::uint16_t) + beamGenericDataSize + phaseDataSize + amplitudeDataSize;
+	}
+
+	assert(src <= data + size);
+	return static_cast<unsigned int>(decompressedSize);
+}
+
+int jp2k_compress_batch(unsigned int count, const char* data, const unsigned int* sizes, char* output, unsigned int outputCapacity, unsigned int* outputSizes, unsigned int* compressedCount)
 {
-	delete data;
+	unsigned int used = 0;
+	for(*compressedCount = 0 ; *compressedCount < count ; ++*compressedCount)
+	{
+		auto i = *compressedCount;
+		auto result = jp2k_compress(data, sizes[i], output + used, outputCapacity - used, &outputSizes[i]);
+		if(result != JP2K_OK)
+			return result;
+		data += sizes[i];
+		used += outputSizes[i];
+	}
+	return JP2K_OK;
+}
+
+bool IsSupportedAmplitudeFormat(GWF::sampleFormat format)
+{
+	std::set<GWF::sampleFormat> supportedSampleFormats = {GWF::sampleFormat::i8, GWF::sampleFormat::u8, GWF::sampleFormat::i16, GWF::sampleFormat::u16};
+	return supportedSampleFormats.find(format) != supportedSampleFormats.end();
+}
+
+size_t CompressedHeaderSize(const GWF::WaterColumn& wcd)
+{
+	size_t size = sizeof(std::uint32_t) + sizeof(PING_TIME_S_TYPE) + sizeof(PING_TIME_US_TYPE) + 2 * sizeof(std::uint8_t) + sizeof(std::uint16_t);
+	size += sizeof(std::uint16_t) + wcd.m_GenericData.size();
+	for(auto& beam : wcd.m_Beams)
+		size += sizeof(std::uint16_t) + beam.m_GenericData.size() + sizeof(std::uint32_t) + beam.m_PhaseData.size() + sizeof(std::uint32_t);
+	return size;
 }
 
 char * WritePingNumber(char * dst, const GWF::WaterColumn & wcd)
@@ -201,20 +310,9 @@ char * WriteBeamAmplitudeSampleCount(char * dst, const GWF::Beam& beam)
 	return SerializeField(dst, (std::uint32_t)beam.m_AmplitudeData.size());
 }
 
-char * WriteAmplitudeSamples(char * dst, const GWF::WaterColumn& wcd)
+char * WriteAmplitudeSamples(char * dst, std::uint32_t uncompressedSize, const std::pair<std::shared_ptr<char>, size_t>& jp2)
 {
-	std::set<GWF::sampleFormat> supportedSampleFormats = {GWF::sampleFormat::i8, GWF::sampleFormat::u8, GWF::sampleFormat::i16, GWF::sampleFormat::u16};
-	if(supportedSampleFormats.find(wcd.m_amplitudeFormat) == supportedSampleFormats.end())
-		return nullptr; // TODO: error reporting
-
-	// Create a PGM from the sample data
-	auto pgm = FormatConversion::WcdSamplesToPgm(wcd);
-	// Then convert the PGM to a JPEG2k
-	auto jp2 = FormatConversion::ConvertPgmToJpeg2k(pgm);
-	// Write the size of the UNCOMPRESSED image
-	std::uint32_t size = pgm.second;
-	assert(size == pgm.second); // Make sure we don't have an overflow
-	dst = SerializeField(dst, size);
+	dst = SerializeField(dst, uncompressedSize);
 	
 	// and write the jpeg2k samples 
 	memcpy(dst, jp2.first.get(), jp2.second);
@@ -3,12 +3,34 @@
 #include <functional>
 #include "WaterColumn.h"
 
-#ifdef JPEG2KLIBRARY_EXPORTS  
-#define JPEG2KLIBRARY_API __declspec(dllexport)   
-#else  
-#define JPEG2KLIBRARY_API __declspec(dllimport)   
-#endif  
+#if defined(_WIN32)
+#ifdef JPEG2KLIBRARY_EXPORTS
+#define JPEG2KLIBRARY_API __declspec(dllexport)
+#else
+#define JPEG2KLIBRARY_API __declspec(dllimport)
+#endif
+#else
+#define JPEG2KLIBRARY_API __attribute__((visibility("default")))
+#endif
 
 JPEG2KLIBRARY_API char* Compress(char* uncompressedData, unsigned int uncompressedDataSize, unsigned int* compressedSize);
 JPEG2KLIBRARY_API char* Decompress(char* compressedData, unsigned int compressedDataSize, unsigned int* decompressedSize);
-JPEG2KLIBRARY_API void Destroy(char* data);
\ No newline at end of file
+JPEG2KLIBRARY_API void Destroy(char* data);
+
+/* Plain C interface. The caller owns all buffers, so nothing has to be copied into or out of library allocated memory.
+   On JP2K_BUFFER_TOO_SMALL the size that is needed is stored in the output size and nothing is written. */
+#define JP2K_OK 0
+#define JP2K_BUFFER_TOO_SMALL 1
+#define JP2K_UNSUPPORTED_SAMPLE_FORMAT 2
+
+extern "C"
+{
+	JPEG2KLIBRARY_API int jp2k_compress(const char* data, unsigned int size, char* output, unsigned int outputCapacity, unsigned int* outputSize);
+	JPEG2KLIBRARY_API int jp2k_decompress(const char* data, unsigned int size, char* output, unsigned int outputCapacity, unsigned int* outputSize);
+	// Size of the record jp2k_decompress will produce, read from the headers of the compressed data without decoding it
+	JPEG2KLIBRARY_API unsigned int jp2k_decompressed_size(const char* data, unsigned int size);
+	// Compresses count records stored back to back in data (sizes[i] bytes each). The compressed records are stored back to
+	// back in output, outputSizes[i] is set to the compressed size of record i. Stops at the first record that fails, the
+	// number of records that were compressed is stored in compressedCount
+	JPEG2KLIBRARY_API int jp2k_compress_batch(unsigned int count, const char* data, const unsigned int* sizes, char* output, unsigned int outputCapacity, unsigned int* outputSizes, unsigned int* compressedCount);
+}
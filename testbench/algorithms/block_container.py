@@ -0,0 +1,108 @@
+'''
+Container format of the record based algorithms (wclzma, jpeg2k). A compressed file is a sequence of blocks, one per
+record: a <II header (block size including header, record ID) followed by the compressed record. Optionally the blocks are
+followed by an index footer that maps record IDs to block offsets, so a single record can be found with one seek. Files
+without the footer can still be read, they are simply scanned from the start.
+'''
+import os
+import struct
+
+_record_header_format = '<II' # block size including header, record ID
+header_length = struct.calcsize(_record_header_format)
+
+_index_entry_format = '<IQ' # record ID, offset of the block
+_trailer_format = '<QI4s' # offset of the index, number of index entries, magic
+_trailer_magic = b'WCBI'
+
+class BlockWriter:
+    def __init__(self, file, write_index = True):
+        self.file = file
+        self.write_index = write_index
+        self.index = []
+
+    def write(self, data, record_id, indexed_record_ids = None):
+        # A block holding several records is indexed under all of their IDs (indexed_record_ids), its header has record_id
+        if self.write_index:
+            offset = self.file.tell()
+            self.index.extend((indexed_record_id, offset) for indexed_record_id in (indexed_record_ids or [record_id]))
+        write_block(data, record_id, self.file)
+
+    def close(self):
+        if not self.write_index:
+            return
+
+        index_offset = self.file.tell()
+        entry = struct.Struct(_index_entry_format)
+        index = bytearray(entry.size * len(self.index))
+        for i, (record_id, offset) in enumerate(self.index):
+            entry.pack_into(index, i * entry.size, record_id, offset)
+        self.file.write(index)
+        self.file.write(struct.pack(_trailer_format, index_offset, len(self.index), _trailer_magic))
+
+def write_compressed_records(records, output_path, write_index = True):
+    '''Write (record ID, compressed record) pairs to output_path, one block per record'''
+    with open(output_path, 'wb') as output_file:
+        writer = BlockWriter(output_file, write_index)
+        for record_id, compressed_data in records:
+            writer.write(compressed_data, record_id)
+        writer.close()
+
+def read_blocks(file, record_id = None):
+    '''Generator of (record ID, compressed data) for all blocks, or only for the block of record_id if given'''
+    index, end_of_blocks = read_index(file)
+    if record_id != None and index != None:
+        if record_id in index:
+            file.seek(index[record_id])
+            block_size, current_record_id = read_block_header(file)
+            yield current_record_id, read_compressed_data(file, block_size)
+        return
+
+    file.seek(0)
+    while file.tell() < end_of_blocks:
+        block_size, current_record_id = read_block_header(file)
+        if record_id == None or record_id == current_record_id:
+            yield current_record_id, read_compressed_data(file, block_size)
+            if record_id != None:
+                return
+        else:
+            skip_block(file, block_size)
+
+def read_index(file):
+    '''Returns the index footer as a dictionary of record ID to block offset (None if the file has no footer) and the end of the blocks'''
+    file_size = os.fstat(file.fileno()).st_size
+    trailer_length = struct.calcsize(_trailer_format)
+    if file_size < trailer_length:
+        return None, file_size
+
+    file.seek(file_size - trailer_length)
+    index_offset, number_of_entries, magic = struct.unpack(_trailer_format, file.read(trailer_length))
+    entry_length = struct.calcsize(_index_entry_format)
+    if magic != _trailer_magic or index_offset + number_of_entries * entry_length + trailer_length != file_size:
+        return None, file_size
+
+    file.seek(index_offset)
+    entries = struct.iter_unpack(_index_entry_format, file.read(number_of_entries * entry_length))
+    index = {}
+    for record_id, offset in entries:
+        index.setdefault(record_id, offset)
+    return index, index_offset
+
+def read_compressed_data(file, block_size):
+    compressed_data_size = block_size - header_length
+    return file.read(compressed_data_size)
+
+def write_block(data, record_id, file):
+    write_block_header(data, record_id, file)
+    file.write(data)
+
+def read_block_header(file):
+    header_data = file.read(header_length)
+    return struct.unpack(_record_header_format, header_data)
+
+def write_block_header(data, record_id, file):
+    block_length = len(data) + header_length
+    file.write(struct.pack(_record_header_format, block_length, record_id))
+
+def skip_block(file, block_size):
+    compressed_data_size = block_size - header_length
+    file.seek(compressed_data_size, 1)
@@ -1,84 +1,170 @@
 import ctypes
-import gwf
-import struct
+import sys
 import os
-
-jp2kdll = ctypes.WinDLL(r'algorithms/jpeg_2k_compression_lib.dll')
-_compress_function = getattr(jp2kdll, "?Compress@@YAPEADPEADIPEAI@Z")
-_decompress_function = getattr(jp2kdll, "?Decompress@@YAPEADPEADIPEAI@Z")
-_destroy_function = getattr(jp2kdll, "?Destroy@@YAXPEAD@Z")
-
-_decompress_function.restype = ctypes.POINTER(ctypes.c_char)
-_compress_function.restype = ctypes.POINTER(ctypes.c_char)
-
-_record_header_format = '<II' # block size including header, record ID
-header_length = struct.calcsize(_record_header_format)
+import gwf
+import json
+import block_container
+
+_library_directory = os.path.dirname(os.path.abspath(__file__))
+if sys.platform == 'win32':
+    jp2kdll = ctypes.WinDLL(os.path.join(_library_directory, 'jpeg_2k_compression_lib.dll'))
+else:
+    # Build from jpeg_2k_ref_implementation, see its README
+    jp2kdll = ctypes.CDLL(os.path.join(_library_directory, 'libjpeg_2k_compression.so'))
+
+# Return codes of the C interface
+JP2K_OK = 0
+JP2K_BUFFER_TOO_SMALL = 1
+JP2K_UNSUPPORTED_SAMPLE_FORMAT = 2
+
+# Libraries built from the current sources have a plain C interface that works on caller owned buffers. The DLL that comes
+# with the test bench only has the original C++ interface, which returns library allocated copies
+_has_buffer_interface = hasattr(jp2kdll, 'jp2k_compress')
+
+if _has_buffer_interface:
+    _c_uint_pointer = ctypes.POINTER(ctypes.c_uint)
+    _compress_function = jp2kdll.jp2k_compress
+    _compress_function.argtypes = [ctypes.c_char_p, ctypes.c_uint, ctypes.c_char_p, ctypes.c_uint, _c_uint_pointer]
+    _compress_function.restype = ctypes.c_int
+    _decompress_function = jp2kdll.jp2k_decompress
+    _decompress_function.argtypes = [ctypes.c_char_p, ctypes.c_uint, ctypes.c_char_p, ctypes.c_uint, _c_uint_pointer]
+    _decompress_function.restype = ctypes.c_int
+    _decompressed_size_function = jp2kdll.jp2k_decompressed_size
+    _decompressed_size_function.argtypes = [ctypes.c_char_p, ctypes.c_uint]
+    _decompressed_size_function.restype = ctypes.c_uint
+    _compress_batch_function = jp2kdll.jp2k_compress_batch
+    _compress_batch_function.argtypes = [ctypes.c_uint, ctypes.c_char_p, _c_uint_pointer, ctypes.c_char_p, ctypes.c_uint, _c_uint_pointer, _c_uint_pointer]
+    _compress_batch_function.restype = ctypes.c_int
+else:
+    _compress_function = getattr(jp2kdll, "?Compress@@YAPEADPEADIPEAI@Z")
+    _decompress_function = getattr(jp2kdll, "?Decompress@@YAPEADPEADIPEAI@Z")
+    _destroy_function = getattr(jp2kdll, "?Destroy@@YAXPEAD@Z")
+
+    _decompress_function.restype = ctypes.POINTER(ctypes.c_char)
+    _compress_function.restype = ctypes.POINTER(ctypes.c_char)
+
+# Room for the headers the codec adds on top of the (assumed not to grow) record
+_output_slack = 4096
+
+block_index = True
+# Number of records handed to the library per call when compressing a file
+batch_size = 64
 
 def init(parameters):
-    pass
+    decoded = json.loads(parameters) if parameters else {}
+    global block_index
+    block_index = decoded.get('block index', True)
+    global batch_size
+    batch_size = decoded.get('batch size', 64)
 
 def compress(input_path, output_path):
-    gwf_file = gwf.File(input_path)
-    with open(output_path, 'wb') as out_file:
-        for record in gwf_file.read():
-            data = record.serialize()
-            compressed_data = _compress(data)
-            write_block(compressed_data, record.ping_number, out_file)
-
-def decompress(input_path, output_path, record_id = None):
-    file_size = os.path.getsize(input_path)
-    with open(input_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
-        while input_file.tell() < file_size:
-            block_size, current_record_id = read_block_header(input_file)
-            if record_id == None or record_id == current_record_id:
-                compressed_data = read_compressed_data(input_file, block_size)
-                decompressed_data = _decompress(compressed_data)
-                write_decompressed_data(output_file, decompressed_data)
-
-                if record_id != None:
-                    return
-            else:
-                skip_block(input_file, block_size)
+    if _has_buffer_interface:
+        write_compressed_records(_compress_batches(input_path), output_path)
+        return
 
-def read_compressed_data(file, block_size):
-    compressed_data_size = block_size - header_length
-    return file.read(compressed_data_size)
-
-def write_decompressed_data(file, data):
-    file.write(data)
-
-def write_block(data, record_id, file):
-    write_block_header(data, record_id, file)
-    file.write(data)
+    gwf_file = gwf.File(input_path)
+    write_compressed_records(((record.ping_number, compress_record(record.serialize())) for record in gwf_file.read()), output_path)
 
-def read_block_header(file):
-    header_data = file.read(header_length)
-    return struct.unpack(_record_header_format, header_data)
+# Per record entry points, used by the test bench for parallel compression
+def compress_record(data):
+    return _compress(data)
 
-def write_block_header(data, record_id, file):
-    block_length = len(data) + header_length
-    file.write(struct.pack(_record_header_format, block_length, record_id))
+def write_compressed_records(records, output_path):
+    block_container.write_compressed_records(records, output_path, block_index)
 
-def skip_block(file, block_size):
-    compressed_data_size = block_size - header_length
-    file.seek(compressed_data_size, 1)
+def decompress(input_path, output_path, record_id = None):
+    with open(input_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
+        for current_record_id, compressed_data in block_container.read_blocks(input_file, record_id):
+            output_file.write(_decompress(compressed_data))
+
+def compress_batch(data, sizes):
+    '''Compress the records stored back to back in data (sizes holds their sizes) in one library call. Returns the compressed
+    records as memoryviews on a single output buffer'''
+    count = len(sizes)
+    sizes = (ctypes.c_uint * count)(*sizes)
+    output_sizes = (ctypes.c_uint * count)()
+    compressed_count = ctypes.c_uint()
+    output = bytearray(len(data) + count * _output_slack)
+    done = input_offset = output_offset = 0
+    while True:
+        result = _compress_batch_function(count - done, _pointer(data, input_offset), _uint_pointer(sizes, done), _pointer(output, output_offset), len(output) - output_offset, _uint_pointer(output_sizes, done), ctypes.byref(compressed_count))
+        input_offset += sum(sizes[done:done + compressed_count.value])
+        output_offset += sum(output_sizes[done:done + compressed_count.value])
+        done += compressed_count.value
+        if result != JP2K_BUFFER_TOO_SMALL:
+            break
+        # output_sizes[done] holds the size the record that did not fit needs, grow the output and carry on from there
+        output.extend(bytes(max(output_sizes[done], len(output))))
+    _check(result)
+
+    view = memoryview(output)
+    compressed = []
+    offset = 0
+    for size in output_sizes:
+        compressed.append(view[offset:offset + size])
+        offset += size
+    return compressed
+
+def _compress_batches(input_path):
+    entries = gwf.File(input_path).index().entries
+    with open(input_path, 'rb') as input_file:
+        for first in range(0, len(entries), batch_size):
+            batch = entries[first:first + batch_size]
+            # GWF records are stored back to back, so a batch is read with a single call straight into the buffer the library gets
+            data = bytearray(int(batch['size'].sum()))
+            input_file.seek(int(batch['file_offset'][0]))
+            input_file.readinto(data)
+            yield from zip(batch['ping_number'].tolist(), compress_batch(data, batch['size'].tolist()))
 
 def _compress(data):
-    compressed_data_length = ctypes.c_uint()
-    compressed = _compress_function(ctypes.c_char_p(data), ctypes.c_uint(len(data)), ctypes.byref(compressed_data_length))
-    data = compressed[:compressed_data_length.value]
-
-    # We now have the data in python space, so the library can deallocate the data
-    _destroy_function(compressed)
-
-    return data
+    if not _has_buffer_interface:
+        compressed_data_length = ctypes.c_uint()
+        compressed = _compress_function(ctypes.c_char_p(data), ctypes.c_uint(len(data)), ctypes.byref(compressed_data_length))
+        data = compressed[:compressed_data_length.value]
+
+        # We now have the data in python space, so the library can deallocate the data
+        _destroy_function(compressed)
+
+        return data
+
+    output = bytearray(len(data) + _output_slack)
+    output_size = ctypes.c_uint()
+    result = _compress_function(_pointer(data), len(data), _pointer(output), len(output), ctypes.byref(output_size))
+    if result == JP2K_BUFFER_TOO_SMALL:
+        output = bytearray(output_size.value)
+        result = _compress_function(_pointer(data), len(data), _pointer(output), len(output), ctypes.byref(output_size))
+    _check(result)
+    del output[output_size.value:]
+    return output
 
 def _decompress(data):
-    decompressed_data_length = ctypes.c_uint()
-    decompressed = _decompress_function(ctypes.c_char_p(data), ctypes.c_uint(len(data)), ctypes.byref(decompressed_data_length))
-    data = decompressed[:decompressed_data_length.value]
-
-    # We now have the data in python space, so the library can deallocate the data
-    _destroy_function(decompressed)
-
-    return data
+    if not _has_buffer_interface:
+        decompressed_data_length = ctypes.c_uint()
+        decompressed = _decompress_function(ctypes.c_char_p(data), ctypes.c_uint(len(data)), ctypes.byref(decompressed_data_length))
+        data = decompressed[:decompressed_data_length.value]
+
+        # We now have the data in python space, so the library can deallocate the data
+        _destroy_function(decompressed)
+
+        return data
+
+    # The size of the record is known from the headers, so the library decodes straight into the final buffer
+    output = bytearray(_decompressed_size_function(_pointer(data), len(data)))
+    output_size = ctypes.c_uint()
+    _check(_decompress_function(_pointer(data), len(data), _pointer(output), len(output), ctypes.byref(output_size)))
+    return output
+
+def _pointer(data, offset = 0):
+    # bytes are passed to the library as they are, other buffers (bytearray, writable memoryview) are wrapped without a copy
+    if isinstance(data, bytes):
+        return data if offset == 0 else data[offset:]
+    return (ctypes.c_char * (len(data) - offset)).from_buffer(data, offset)
+
+def _uint_pointer(array, index):
+    return ctypes.cast(ctypes.byref(array, index * ctypes.sizeof(ctypes.c_uint)), ctypes.POINTER(ctypes.c_uint))
+
+def _check(result):
+    if result == JP2K_UNSUPPORTED_SAMPLE_FORMAT:
+        raise ValueError('Amplitude sample format not supported by the JPEG 2000 library')
+    if result != JP2K_OK:
+        raise RuntimeError('JPEG 2000 library returned error {}'.format(result))
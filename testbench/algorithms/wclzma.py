@@ -1,65 +1,158 @@
-import os
-import pylzma
-import gwf
+import lzma
 import struct
+import gwf
 import json
 import logging
+import block_container
 
-_record_header_format = '<II' # block size including header, record ID
-header_length = struct.calcsize(_record_header_format)
+try:
+    import pylzma
+except ImportError:
+    # Only needed by the pylzma backend
+    pylzma = None
 
 compression_mode = 2
+block_index = True
+
+# Backend "pylzma" (default) uses compression mode, backend "lzma" uses the standard library with a raw filter chain
+backend = 'pylzma'
+preset = 6
+extreme = False
+# Distance in bytes of the delta filter put in front of LZMA2, 2 suits 16 bit samples. 0 leaves the filter out
+delta_distance = 0
+# Explicit filter chain for the lzma backend, e.g. [{"id": "delta", "dist": 2}, {"id": "lzma2", "preset": 9}]. Overrides
+# preset, extreme and delta distance
+filters = None
+# Number of consecutive records compressed as one LZMA stream (lzma backend). Small records compress badly on their own;
+# records in a block share the dictionary, at the cost of decompressing the block up to the record for random access
+records_per_block = 1
+# Records are only compressed independently (and thus in parallel by the test bench) when blocks hold a single record
+parallel_compression = True
+
+_filter_ids = {
+    'delta': lzma.FILTER_DELTA,
+    'lzma1': lzma.FILTER_LZMA1,
+    'lzma2': lzma.FILTER_LZMA2,
+    'x86': lzma.FILTER_X86,
+    'arm': lzma.FILTER_ARM,
+    'armthumb': lzma.FILTER_ARMTHUMB,
+    'powerpc': lzma.FILTER_POWERPC,
+    'ia64': lzma.FILTER_IA64,
+    'sparc': lzma.FILTER_SPARC,
+}
+
+_group_count_format = '<I' # number of records in the block
+_group_entry_format = '<II' # record ID, uncompressed record size
 
 def init(parameters):
     decoded = json.loads(parameters)
     global compression_mode
-    if 'compression mode' in decoded:
-        compression_mode =  decoded['compression mode']
-    else:
+    compression_mode = decoded.get('compression mode', 2)
+    if 'compression mode' not in decoded and decoded.get('backend', 'pylzma') == 'pylzma':
         logging.warning('Parameters did not contain expected field "compression mode". using default compression mode {}'.format(compression_mode))
+    global block_index
+    block_index = decoded.get('block index', True)
+
+    global backend, preset, extreme, delta_distance, filters, records_per_block, parallel_compression
+    backend = decoded.get('backend', 'pylzma')
+    preset = decoded.get('preset', 6)
+    extreme = decoded.get('extreme', False)
+    delta_distance = decoded.get('delta distance', 0)
+    filters = decoded.get('filters')
+    records_per_block = decoded.get('records per block', 1)
+
+    if backend == 'pylzma':
+        if pylzma is None:
+            raise ImportError('The pylzma backend of wclzma needs the pylzma package')
+        if records_per_block != 1:
+            logging.warning('"records per block" is only supported by the lzma backend, compressing records one by one')
+            records_per_block = 1
+    elif backend != 'lzma':
+        raise ValueError('Unknown wclzma backend "{}"'.format(backend))
+    parallel_compression = records_per_block == 1
 
 def compress(input_path, output_path):
     gwf_file = gwf.File(input_path)
-    with open(output_path, 'wb') as output_file:
-        for record in gwf_file.read():
-            compressed = pylzma.compress(record.serialize(), algorithm=compression_mode)
-            write_block(compressed, record.ping_number, output_file)
+    if records_per_block > 1:
+        return _compress_blocks(gwf_file, output_path)
+    write_compressed_records(((record.ping_number, compress_record(record.serialize())) for record in gwf_file.read()), output_path)
+
+# Records are compressed independently, so the test bench can compress them in parallel with compress_record and hand the
+# results to write_compressed_records in record order
+def compress_record(data):
+    if backend == 'lzma':
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_filter_chain())
+    return pylzma.compress(data, algorithm=compression_mode)
+
+def _decompress(data):
+    if backend == 'lzma':
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=_filter_chain())
+    return pylzma.decompress(data)
+
+def write_compressed_records(records, output_path):
+    block_container.write_compressed_records(records, output_path, block_index)
 
 def decompress(input_path, output_path, record_id = None):
-    file_size = os.path.getsize(input_path)
     with open(input_path, 'rb') as input_file, open(output_path, 'wb') as output_file:
-        while input_file.tell() < file_size:
-            block_size, current_record_id = read_block_header(input_file)
-            if record_id == None or record_id == current_record_id:
-                compressed_data = read_compressed_data(input_file, block_size)
-                decompressed_data = pylzma.decompress(compressed_data)
-                write_decompressed_data(output_file, decompressed_data)
+        if records_per_block > 1:
+            return _decompress_blocks(input_file, output_file, record_id)
 
-                if record_id != None:
-                    return
+        for current_record_id, compressed_data in block_container.read_blocks(input_file, record_id):
+            output_file.write(_decompress(compressed_data))
 
-            else:
-                skip_block(input_file, block_size)
+def _filter_chain():
+    if filters is not None:
+        return [dict(chain_filter, id=_filter_ids[chain_filter['id']]) for chain_filter in filters]
 
-def read_compressed_data(file, block_size):
-    compressed_data_size = block_size - header_length
-    return file.read(compressed_data_size)
+    chain = []
+    if delta_distance > 0:
+        chain.append({'id': lzma.FILTER_DELTA, 'dist': delta_distance})
+    chain.append({'id': lzma.FILTER_LZMA2, 'preset': preset | (lzma.PRESET_EXTREME if extreme else 0)})
+    return chain
 
-def write_decompressed_data(file, data):
-    file.write(data)
+def _compress_blocks(gwf_file, output_path):
+    with open(output_path, 'wb') as output_file:
+        writer = block_container.BlockWriter(output_file, block_index)
+        group = []
+        for record in gwf_file.read():
+            group.append((record.ping_number, record.serialize()))
+            if len(group) == records_per_block:
+                _write_group(writer, group)
+                group = []
+        if group:
+            _write_group(writer, group)
+        writer.close()
 
-def write_block(data, record_id, file):
-    write_block_header(data, record_id, file)
-    file.write(data)
+def _write_group(writer, group):
+    # Block layout: number of records, (record ID, size) per record, then the records compressed as one stream
+    entry = struct.Struct(_group_entry_format)
+    header = bytearray(struct.calcsize(_group_count_format) + entry.size * len(group))
+    struct.pack_into(_group_count_format, header, 0, len(group))
+    for i, (record_id, data) in enumerate(group):
+        entry.pack_into(header, struct.calcsize(_group_count_format) + i * entry.size, record_id, len(data))
+    compressed_data = lzma.compress(b''.join(data for record_id, data in group), format=lzma.FORMAT_RAW, filters=_filter_chain())
+    record_ids = [record_id for record_id, data in group]
+    writer.write(bytes(header) + compressed_data, record_ids[0], record_ids)
 
-def read_block_header(file):
-    header_data = file.read(header_length)
-    return struct.unpack(_record_header_format, header_data)
+def _decompress_blocks(input_file, output_file, record_id):
+    # Blocks are indexed under every record they hold; without an index the block of a record can only be found by looking
+    # at the records of all blocks
+    index, end_of_blocks = block_container.read_index(input_file)
+    for current_record_id, data in block_container.read_blocks(input_file, record_id if index is not None else None):
+        (count,) = struct.unpack_from(_group_count_format, data)
+        offset = struct.calcsize(_group_count_format)
+        entries = list(struct.iter_unpack(_group_entry_format, data[offset:offset + count * struct.calcsize(_group_entry_format)]))
+        offset += count * struct.calcsize(_group_entry_format)
 
-def write_block_header(data, record_id, file):
-    block_length = len(data) + header_length
-    file.write(struct.pack(_record_header_format, block_length, record_id))
+        if record_id is None:
+            output_file.write(lzma.decompress(data[offset:], format=lzma.FORMAT_RAW, filters=_filter_chain()))
+            continue
 
-def skip_block(file, block_size):
-    compressed_data_size = block_size - header_length
-    file.seek(compressed_data_size, 1)
+        record_offset = 0
+        for entry_record_id, size in entries:
+            if entry_record_id == record_id:
+                # Only decompress up to the end of the requested record
+                decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=_filter_chain())
+                output_file.write(decompressor.decompress(data[offset:], max_length=record_offset + size)[record_offset:])
+                return
+            record_offset += size
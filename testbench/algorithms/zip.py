@@ -1,23 +1,63 @@
 import zipfile
+import shutil
 import json
-from gwf import File as gwf
 import os
+from gwf import File as gwf, GenericWaterColumnPing
 
 deflate = False
+# 0 stores the whole file as a single member. Otherwise every member holds this many consecutive records and an index
+# member maps record IDs to their member, so a single record can be inflated without touching the rest of the archive
+records_per_member = 0
+
+_index_member_name = 'index.json'
+
+# Data is streamed through ZipFile.open in pieces of this size, so memory use does not grow with the file size
+buffer_size = 1024**2
+
+# Parsed record indices of archives by path, with the size and modification time of the archive they were read from
+_index_cache = {}
 
 def init(parameters):
     decoded = json.loads(parameters)
     global deflate
-    if 'compress' in decoded:
-        deflate =  decoded['compress']
+    deflate = decoded.get('compress', False)
+    global records_per_member
+    records_per_member = decoded.get('records per member', 0)
 
 def compress(input_path, output_path):
+    if records_per_member > 0:
+        return compress_records(input_path, output_path)
+
     with open(input_path, 'rb') as input_file:
         mode = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
         with zipfile.ZipFile(output_path, 'w', mode) as myzip:
-            myzip.write(input_path)
+            info = zipfile.ZipInfo.from_file(input_path)
+            info.compress_type = mode
+            with myzip.open(info, 'w', force_zip64=True) as member:
+                shutil.copyfileobj(input_file, member, buffer_size)
         return 0
 
+def compress_records(input_path, output_path):
+    entries = gwf(input_path).index().entries
+    mode = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+    index = {}
+    with open(input_path, 'rb') as input_file, zipfile.ZipFile(output_path, 'w', mode) as myzip:
+        for first in range(0, len(entries), records_per_member):
+            chunk = entries[first:first + records_per_member]
+            member_name = 'records_{:08d}'.format(first)
+            chunk_offset = int(chunk['file_offset'][0])
+            for ping_number, file_offset, size in zip(chunk['ping_number'].tolist(), chunk['file_offset'].tolist(), chunk['size'].tolist()):
+                index.setdefault(str(ping_number), (member_name, file_offset - chunk_offset, size))
+
+            # GWF files are nothing but consecutive records, so the members together hold the file byte for byte
+            input_file.seek(chunk_offset)
+            info = zipfile.ZipInfo(member_name)
+            info.compress_type = mode
+            with myzip.open(info, 'w', force_zip64=True) as member:
+                _copy(input_file, member, int(chunk['file_offset'][-1]) + int(chunk['size'][-1]) - chunk_offset)
+        myzip.writestr(_index_member_name, json.dumps(index))
+    return 0
+
 def decompress(input_path, output_path, record_id = None):
     if(record_id != None):
         return decompress_record(input_path, output_path, record_id)
@@ -26,21 +66,52 @@ def decompress(input_path, output_path, record_id = None):
         mode = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
         with zipfile.ZipFile(input_path, 'r', mode) as myzip:
             objects = myzip.infolist()
-            assert len(objects) == 1
-            output_file.write( myzip.read(objects[0]))
+            if _index_member_name in myzip.namelist():
+                objects = [info for info in objects if info.filename != _index_member_name]
+            else:
+                assert len(objects) == 1
+            for info in objects:
+                with myzip.open(info) as member:
+                    shutil.copyfileobj(member, output_file, buffer_size)
         return 0
 
 def decompress_record(input_path, output_path, record_id):
-    # decompress the file to a temporary location
-    temp_file = output_path + '_TEMP'
-    decompress(input_path, temp_file)
-    #use GWF to read the entire file
-    gwf_file = gwf(temp_file)
-    for wc in gwf_file.read():
-        if wc.ping_number == record_id:
-            with open(output_path, 'wb') as f:
-                f.write(wc.serialize())
-            break
-    os.remove(temp_file)
+    with zipfile.ZipFile(input_path, 'r') as myzip:
+        if _index_member_name in myzip.namelist():
+            index = _read_index(input_path, myzip)
+            if str(record_id) in index:
+                member_name, offset, size = index[str(record_id)]
+                with myzip.open(member_name) as member:
+                    member.seek(offset)
+                    data = member.read(size)
+                with open(output_path, 'wb') as f:
+                    f.write(data)
+            return
+
+        # Single member archive: walk the records in the decompressed stream until the requested one shows up
+        info = myzip.infolist()[0]
+        with myzip.open(info) as member:
+            while member.tell() < info.file_size:
+                wc = GenericWaterColumnPing.from_file(member)
+                if wc.ping_number == record_id:
+                    with open(output_path, 'wb') as f:
+                        f.write(wc.serialize())
+                    break
 
+def _read_index(path, myzip):
+    # Parsing the index takes time proportional to the number of records, so it is only done once per archive
+    stat = os.stat(path)
+    state = (stat.st_size, stat.st_mtime_ns)
+    cached = _index_cache.get(path)
+    if cached is None or cached[0] != state:
+        cached = (state, json.loads(myzip.read(_index_member_name)))
+        _index_cache[path] = cached
+    return cached[1]
 
+def _copy(source, destination, size):
+    while size > 0:
+        data = source.read(min(size, buffer_size))
+        if not data:
+            raise EOFError('Unexpected end of {}'.format(source.name))
+        destination.write(data)
+        size -= len(data)
@@ -0,0 +1,76 @@
+'''Record-parallel compression. The records of a GWF file are compressed by a pool of worker processes using the algorithm's
+compress_record function and written back in record order by the algorithm's write_compressed_records function.'''
+from multiprocessing import Pool, cpu_count
+from gwf import File as gwf_file
+import importlib
+import timer
+import os
+import sys
+
+# Worker process state, set up by _init_worker
+_module = None
+_input_file = None
+
+def supports_parallel_compression(module):
+    # An algorithm can switch record-parallel compression off for configurations that do not compress records independently
+    return hasattr(module, 'compress_record') and hasattr(module, 'write_compressed_records') and getattr(module, 'parallel_compression', True)
+
+def number_of_processes(requested):
+    return requested if requested > 0 else cpu_count()
+
+class CompressionPool:
+    def __init__(self, module_path, parameters, input_path, processes):
+        self.input_path = input_path
+        self.processes = number_of_processes(processes)
+        self.pool = Pool(self.processes, initializer=_init_worker, initargs=(module_path, parameters, input_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def compress(self, module, output_path):
+        '''Compress the input file to output_path. Returns the CPU time and I/O the workers spent on it, as the sum of their
+        timer.process_counters differences'''
+        index = gwf_file(self.input_path).index()
+        records = zip(index.entries['ping_number'].tolist(), index.entries['file_offset'].tolist(), index.entries['size'].tolist())
+        # imap hands results back in submission order, so blocks end up in the same order as a sequential compression
+        chunk_size = max(1, len(index) // (self.processes * 16))
+        worker_counters = (0.0, 0.0, 0, 0)
+
+        def compressed_records():
+            nonlocal worker_counters
+            for ping_number, compressed_data, counters in self.pool.imap(_compress_record, records, chunk_size):
+                worker_counters = timer.counter_sum(worker_counters, counters)
+                yield ping_number, compressed_data
+
+        module.write_compressed_records(compressed_records(), output_path)
+        return worker_counters
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+def load_module(module_path):
+    # Algorithms are loaded the same way as in the test bench itself, so worker processes get the same module
+    base = os.path.split(module_path)[0]
+    name = os.path.splitext(os.path.split(module_path)[1])[0]
+    if base not in sys.path:
+        sys.path.append(base)
+    return importlib.import_module(name)
+
+def _init_worker(module_path, parameters, input_path):
+    global _module, _input_file
+    _module = load_module(module_path)
+    _module.init(parameters)
+    _input_file = open(input_path, 'rb')
+
+def _compress_record(record):
+    # The serialized form of a GWF record is exactly its bytes on disk, so workers read records straight from the file
+    ping_number, file_offset, size = record
+    # Workers live as long as the pool, so the test bench never waits for them and their CPU time and I/O are reported per record
+    before = timer.process_counters()
+    _input_file.seek(file_offset)
+    compressed_data = _module.compress_record(_input_file.read(size))
+    return ping_number, compressed_data, timer.counter_difference(before, timer.process_counters())
@@ -1,98 +1,158 @@
-import numpy as np
-import psutil
-import time
-from loadgenerator import CPU_load_generator
+'''Emulation of the acquisition machine for the real-time metric. The function is run in a child process that is confined to
+the CPU and memory the acquisition software leaves available:
+
+- With cgroup v2 the child is put in its own cgroup with cpu.max set to the available share of the machine and memory.max
+  to the available memory. The kernel enforces both, so the result does not depend on what else runs on the machine. The
+  cgroup is created in a cgroup delegated to the test bench: cgroup v2 only allows controllers to be enabled for child
+  cgroups of a cgroup that holds no processes itself, which rules out the cgroup the test bench runs in.
+- Without a delegated cgroup (or without the rights to use it) the child is pinned to the number of cores that makes up the
+  available share, rounded up, and its address space is limited with RLIMIT_AS. This is coarser: a fraction of a core
+  cannot be emulated and the address space limit also counts memory that is mapped but never used.'''
+import multiprocessing
 import logging
+import math
+import os
 
-class RealTimeEmulation:
-    def __init__(self):
-        self.number_of_logical_cores = None
-        self.load_generator = CPU_load_generator()
-        self.allocated_memory = None
-        pass
-
-    def time(self, function, timer_function, available_cpu, available_memory):
-        if available_cpu < 0 or available_cpu > 100:
-            raise ValueError
-
-        if available_memory < 0:
-            raise ValueError
-
-        time.sleep(1)
-        current_cpu_load = self._get_current_cpu_load()
-
-        self._claim_memory(available_memory)
-
-        required_additional_load = 100 - available_cpu - current_cpu_load
-
-        lower_load, upper_load = self._get_load_bounds(required_additional_load)
+try:
+    import resource
+except ImportError:
+    resource = None
 
-        logging.debug('Starting lower bound: {}%'.format(lower_load))
-        lower_time = self._time_under_cpu_load(function, timer_function, lower_load)
-        if lower_load == upper_load:
-            return lower_time
+# Scheduling period of cpu.max in microseconds
+_cpu_period = 100000
 
-        logging.debug('Starting upper bound: {}%'.format(upper_load))
-        upper_time = self._time_under_cpu_load(function, timer_function, upper_load)
-
-        logging.debug('Interpolating to {} from using {} and {}'.format(required_additional_load, lower_time, upper_time))
-
-        self._release_claimed_memory()
-
-        return np.interp(required_additional_load, [lower_load, upper_load], [lower_time, upper_time])
-
-    def _get_current_cpu_load(self):
-        time.sleep(1)
-        return psutil.cpu_percent(3)
-
-    def _claim_memory(self, requested_available_meory):
-        requested_available_meory = requested_available_meory * 1024**2
-        available_memory = psutil.virtual_memory().available
-        to_allocate = available_memory - requested_available_meory
-        if to_allocate <= 0:
-            #TODO: log
-            return
-
-        self.allocated_memory = bytearray(to_allocate)
+class RealTimeEmulation:
+    def __init__(self, cgroup = None):
+        # cgroup: directory of a cgroup v2 without processes of its own that the test bench may create child cgroups in
+        # (e.g. one delegated to the user by systemd)
+        self.cgroup = cgroup
+        self.number_of_logical_cores = multiprocessing.cpu_count()
+        self.warned = False
+
+    def run(self, function, available_cpu, available_memory):
+        '''Call function on available_cpu percent of the machine and available_memory MB and return its result, which must be
+        picklable. Raises MemoryError when function runs out of memory under the limits'''
+        if available_cpu <= 0 or available_cpu > 100:
+            raise ValueError('Available CPU must be a percentage above 0, got {}'.format(available_cpu))
+
+        if available_memory <= 0:
+            raise ValueError('Available memory must be positive, got {}'.format(available_memory))
+
+        # The function usually closes over a loaded plugin, which only a forked child inherits
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            logging.warning('Real-time emulation needs fork to confine the compression, running it without limits')
+            return function()
+
+        cgroup = self._create_cgroup(available_cpu, available_memory)
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(False)
+        child = context.Process(target=self._run_confined, args=(function, available_cpu, available_memory, cgroup, sender))
+        try:
+            child.start()
+            sender.close()
+            try:
+                succeeded, result = receiver.recv()
+            except EOFError:
+                # The child died without reporting back
+                child.join()
+                if cgroup is not None and _oom_kills(cgroup) > 0:
+                    succeeded, result = False, MemoryError()
+                else:
+                    succeeded, result = False, RuntimeError('Real-time emulation process ended with exit code {} without a result'.format(child.exitcode))
+            child.join()
+        finally:
+            receiver.close()
+            if cgroup is not None:
+                _remove_cgroup(cgroup)
+
+        if not succeeded:
+            # Raised again in the test bench process
+            raise result
+        return result
+
+    def _run_confined(self, function, available_cpu, available_memory, cgroup, sender):
+        if cgroup is not None:
+            _write(os.path.join(cgroup, 'cgroup.procs'), os.getpid())
+        else:
+            self._limit_process(available_cpu, available_memory)
+
+        try:
+            result = (True, function())
+        except Exception as error:
+            result = (False, error)
+        try:
+            sender.send(result)
+        except Exception as error:
+            # Results and exceptions that cannot be pickled are reported by their description
+            sender.send((False, RuntimeError('Real-time emulation could not return {!r}: {}'.format(result[1], error))))
+        sender.close()
+
+    def _create_cgroup(self, available_cpu, available_memory):
+        if self.cgroup is None:
+            self._warn_fallback('No cgroup configured for real-time emulation')
+            return None
+
+        path = os.path.join(self.cgroup, 'testbench-realtime-{}'.format(os.getpid()))
+        try:
+            _write(os.path.join(self.cgroup, 'cgroup.subtree_control'), '+cpu +memory')
+            os.mkdir(path)
+        except OSError as error:
+            self._warn_fallback('Cannot create a cgroup in {} ({})'.format(self.cgroup, error))
+            return None
+
+        try:
+            quota = max(1000, int(_cpu_period * self.number_of_logical_cores * available_cpu / 100))
+            _write(os.path.join(path, 'cpu.max'), '{} {}'.format(quota, _cpu_period))
+            _write(os.path.join(path, 'memory.max'), available_memory * 1024**2)
+            if os.path.exists(os.path.join(path, 'memory.swap.max')):
+                # Swapping would turn running out of memory into a slowdown that depends on the disk
+                _write(os.path.join(path, 'memory.swap.max'), 0)
+        except OSError as error:
+            self._warn_fallback('Cannot set the limits of cgroup {} ({})'.format(path, error))
+            _remove_cgroup(path)
+            return None
+        return path
+
+    def _warn_fallback(self, reason):
+        # Once per run, the reason is the same for every measurement
+        if not self.warned:
+            logging.warning('{}, confining real-time compression with CPU affinity and an address space limit. Set "real-time cgroup" to a delegated cgroup v2 for exact limits'.format(reason))
+            self.warned = True
+
+    def _limit_process(self, available_cpu, available_memory):
+        if hasattr(os, 'sched_setaffinity'):
+            cores = sorted(os.sched_getaffinity(0))
+            number_of_cores = max(1, math.ceil(len(cores) * available_cpu / 100))
+            os.sched_setaffinity(0, cores[:number_of_cores])
+        else:
+            logging.warning('CPU affinity is not supported on this platform, timing real-time compression on all cores')
+
+        if resource is not None:
+            limit = available_memory * 1024**2
+            soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+            if hard != resource.RLIM_INFINITY:
+                limit = min(limit, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+        else:
+            logging.warning('Memory limits are not supported on this platform, timing real-time compression without one')
+
+def _oom_kills(cgroup):
+    try:
+        with open(os.path.join(cgroup, 'memory.events')) as events:
+            for line in events:
+                name, value = line.split()
+                if name == 'oom_kill':
+                    return int(value)
+    except (OSError, ValueError):
         pass
+    return 0
+
+def _remove_cgroup(path):
+    try:
+        os.rmdir(path)
+    except OSError as error:
+        logging.warning('Could not remove cgroup {}: {}'.format(path, error))
 
-    def _release_claimed_memory(self):
-        self.allocated_memory = None
-
-    def _time_under_cpu_load(self, function, timer_function, load):
-        self.load_generator.start(load)
-        time = self._time_function(function, timer_function)
-        self.load_generator.stop()
-        return time
-
-    def _time_function(self, function, timer_function):
-        start = timer_function()
-        function()
-        return timer_function() - start
-
-    def _get_load_bounds(self, load):
-        start_load = None
-        end_load = None
-
-        if load < 0:
-            load = 0
-
-        possible_loads = self.load_generator.possible_loads()
-
-        for s, e in [(possible_loads[i], possible_loads[i+1]) for i in range(len(possible_loads)-1)]:
-            if s == load:
-                start_load = s
-                end_load = start_load
-                break
-            elif e == load:
-                start_load = s
-                end_load = start_load
-                break
-            elif s < load and e > load:
-                start_load = s
-                end_load = e
-                break
-
-        assert start_load != None and end_load != None
-
-        return (start_load, end_load)
+def _write(path, value):
+    with open(path, 'w') as f:
+        f.write(str(value))
@@ -0,0 +1,66 @@
+'''Streaming replay of a GWF file. Pings are handed to the algorithm's compress_record one at a time as they would arrive from
+the echosounder, at the times stored in the file. A ping that arrives while an earlier one is still being compressed waits
+in the acquisition buffer. This shows whether an algorithm keeps up with the ping rate, which the average compression time
+cannot: a few slow pings build up a backlog that delays the pings behind them. Only algorithms that compress records
+independently can be replayed, see parallel.supports_parallel_compression.'''
+from gwf import File as gwf_file
+import numpy as np
+import time
+
+metric_names = ['Replay ping rate', 'Replay deadline', 'Replay latency', 'Replay median latency', 'Replay latency p95', 'Replay latency p99',
+                'Replay latency max', 'Replay backlog', 'Replay backlog max', 'Replay missed deadlines', 'Replay missed deadline fraction']
+
+def replay(module, input_path, output_path, duration = 0, deadline = 0):
+    '''Replay the first duration seconds of input_path (0 replays the whole file) through module.compress_record, writing
+    the compressed records to output_path. A ping misses its deadline when it is not compressed and written within
+    deadline seconds of its arrival; 0 uses the median time between pings. Returns the replay metrics'''
+    index = gwf_file(input_path).index()
+    if len(index) == 0:
+        # Nothing to replay, the metrics are not defined
+        return {metric : float('nan') for metric in metric_names}
+    arrivals = index.times - index.times[0]
+    if duration > 0:
+        arrivals = arrivals[arrivals <= duration]
+    entries = index.entries[:len(arrivals)]
+    if deadline <= 0:
+        deadline = float(np.median(np.diff(arrivals))) if len(arrivals) > 1 else float('inf')
+
+    latencies = np.empty(len(arrivals))
+    backlogs = np.empty(len(arrivals), dtype=np.int64)
+
+    def records(input_file, start):
+        for i, (ping_number, file_offset, size) in enumerate(zip(entries['ping_number'].tolist(), entries['file_offset'].tolist(), entries['size'].tolist())):
+            now = time.perf_counter() - start
+            if now < arrivals[i]:
+                # Caught up, wait for the echosounder
+                time.sleep(arrivals[i] - now)
+                now = time.perf_counter() - start
+            # Pings that have arrived but are not being compressed yet, this one included
+            backlogs[i] = np.searchsorted(arrivals, now, side='right') - i
+
+            input_file.seek(file_offset)
+            yield ping_number, module.compress_record(input_file.read(size))
+
+            # The ping is done once the algorithm has written it, which happens before it asks for the next one
+            latencies[i] = time.perf_counter() - start - arrivals[i]
+
+    with open(input_path, 'rb') as input_file:
+        module.write_compressed_records(records(input_file, time.perf_counter()), output_path)
+
+    return metrics(arrivals, latencies, backlogs, deadline)
+
+def metrics(arrivals, latencies, backlogs, deadline):
+    missed = int(np.count_nonzero(latencies > deadline))
+    return {
+        'Replay ping rate' : (len(arrivals) - 1) / arrivals[-1] if arrivals[-1] > 0 else 0.0,
+        'Replay deadline' : deadline,
+        'Replay latency' : float(np.mean(latencies)),
+        'Replay median latency' : float(np.median(latencies)),
+        'Replay latency p95' : float(np.percentile(latencies, 95)),
+        'Replay latency p99' : float(np.percentile(latencies, 99)),
+        'Replay latency max' : float(np.max(latencies)),
+        'Replay backlog' : float(np.mean(backlogs)),
+        'Replay backlog max' : int(np.max(backlogs)),
+        'Replay missed deadlines' : missed,
+        'Replay missed deadline fraction' : missed / len(latencies)
+    }
@@ -1,10 +1,46 @@
 import sqlite3
 import datetime
 import logging
+import timer
 
 class NoStoredResultsError(Exception):
     pass
 
+# Metrics that are stored: metric name in the results dictionary, column name in the results table and column type.
+# Metrics that are not part of the results of an algorithm are stored as NULL.
+columns = [
+    ('Compression ratio', 'Compression ratio', 'REAL'),
+    ('Compression time', 'Compression time', 'REAL'),
+    ('Decompression time', 'Decompression time', 'REAL'),
+    ('Losslessness', 'Lossless', 'BOOLEAN'),
+    ('Random access decompression time', 'Random access decompression time', 'REAL'),
+    ('Real-time compression time', 'Real-time compression time', 'REAL'),
+    ('Real-time', 'Real-time', 'REAL'),
+    ('Processing', 'Procesing', 'REAL'),
+    ('Cost', 'Cost', 'REAL'),
+    ('Parallel compression time', 'Parallel compression time', 'REAL'),
+    ('Parallel speedup', 'Parallel speedup', 'REAL'),
+    ('Replay ping rate', 'Replay ping rate', 'REAL'),
+    ('Replay deadline', 'Replay deadline', 'REAL'),
+    ('Replay latency', 'Replay latency', 'REAL'),
+    ('Replay median latency', 'Replay median latency', 'REAL'),
+    ('Replay latency p95', 'Replay latency p95', 'REAL'),
+    ('Replay latency p99', 'Replay latency p99', 'REAL'),
+    ('Replay latency max', 'Replay latency max', 'REAL'),
+    ('Replay backlog', 'Replay backlog', 'REAL'),
+    ('Replay backlog max', 'Replay backlog max', 'INTEGER'),
+    ('Replay missed deadlines', 'Replay missed deadlines', 'INTEGER'),
+    ('Replay missed deadline fraction', 'Replay missed deadline fraction', 'REAL'),
+]
+
+# Statistics of the repeated timings (see timer.repeat), the columns above hold the mean
+timed_metrics = ['Compression time', 'Decompression time', 'Random access decompression time', 'Parallel compression time']
+columns += [('{} {}'.format(metric, statistic), '{} {}'.format(metric, statistic), 'REAL') for metric in timed_metrics for field, statistic in timer.statistic_names]
+
+# Resources used per phase, see timer.resource_usage
+measured_phases = ['Compression', 'Decompression', 'Random access decompression', 'Parallel compression', 'Real-time compression', 'Real-time replay']
+columns += [('{} {}'.format(phase, name), '{} {}'.format(phase, name), 'REAL') for phase in measured_phases for field, name in timer.usage_names]
+
 class StorageManager:
     def __init__(self):
         self.file_name = 'results.sqlite'
@@ -13,78 +49,61 @@ class StorageManager:
 
     def store(self, results):
          table_name = 'results-{}'.format(datetime.datetime.now())
+         column_definitions = ''.join(',\n                        "{}" {}'.format(column, column_type) for metric, column, column_type in columns)
          create_string = '''CREATE TABLE IF NOT EXISTS "{}" (
                         File TEXT,
-                        Algorithm TEXT,
-                        "Compression ratio" REAL,
-                        "Compression time" REAL,
-                        "Decompression time" REAL,
-                        "Lossless" INTEGER,
-                        "Random access decompression time"  REAL,
-                        'Real-time compression time' REAL,
-                        "Real-time" REAL,
-                        "Procesing" REAL,
-                        "Cost" REAL
+                        Algorithm TEXT{}
                          );'''
 
-         self.cursor.execute(create_string.format(table_name))
+         self.cursor.execute(create_string.format(table_name, column_definitions))
+
+         insert_string = '''INSERT INTO "{table_name}" (File,Algorithm,{columns})
+                VALUES(?,?,{values})'''.format(table_name=table_name,
+                                                 columns=','.join('"{}"'.format(column) for metric, column, column_type in columns),
+                                                 values=','.join('?' for column in columns))
 
          for algorithm, algorithm_results in results.items():
              for file, file_results in algorithm_results.items():
-                insert_string = '''INSERT INTO "{table_name}" (File,Algorithm,"Compression ratio","Compression time","Decompression time","Lossless","Random access decompression time", 'Real-time compression time', "Real-time", "Procesing","Cost")
-                VALUES("{file}","{algorithm}",{cr},{ct},{dt},{lossless}, {ra_dt}, {rt_ct}, {realtime}, {processing}, {cost})'''
-                insert_string = insert_string.format( table_name=table_name,
-                                      file=file,
-                                      algorithm=algorithm,
-                                      cr=file_results['Compression ratio'],
-                                      ct=file_results['Compression time'],
-                                      dt=file_results['Decompression time'],
-                                      lossless='1' if file_results['Losslessness'] else '0',
-                                      processing=file_results['Processing'],
-                                      realtime=file_results['Real-time'],
-                                      cost=file_results['Cost'],
-                                      ra_dt = file_results['Random access decompression time'],
-                                      rt_ct = file_results['Real-time compression time'])
-                logging.debug('Exexuting SQL query: {}'.format(insert_string))
-                self.cursor.execute(insert_string)
+                values = [file, algorithm] + [self._to_column(file_results.get(metric), column_type) for metric, column, column_type in columns]
+                logging.debug('Exexuting SQL query: {} with values {}'.format(insert_string, values))
+                self.cursor.execute(insert_string, values)
          self.conn.commit()
 
     def fetch_most_recent(self):
         table = self._get_most_recent_table()
         print(table)
         self.cursor.execute('SELECT * FROM "{}";'.format(table))
+        # Tables stored by earlier versions of the test bench do not have all columns
+        stored_columns = [description[0] for description in self.cursor.description]
         rows = self.cursor.fetchall()
         metrics = {}
         for row in rows:
-            file = row[0]
-            algorithm = row[1]
-            compression_ratio = row[2]
-            compression_time = row[3]
-            decompression_time = row[4]
-            lossless = row[5]
-            ra_decompression_time = row[6]
-            rt_compression_time = row[7]
-            real_time = row[8]
-            processing = row[9]
-            cost = row[10]
+            row = dict(zip(stored_columns, row))
+            file = row['File']
+            algorithm = row['Algorithm']
 
             if algorithm not in metrics:
                 metrics[algorithm] = {}
             if file not in metrics[algorithm]:
                 metrics[algorithm][file] = {}
 
-            metrics[algorithm][file]['Compression ratio'] = compression_ratio
-            metrics[algorithm][file]['Compression time'] = compression_time
-            metrics[algorithm][file]['Decompression time'] = decompression_time
-            metrics[algorithm][file]['Losslessness'] = False if lossless == 0 else True
-            metrics[algorithm][file]['Random access decompression time'] = ra_decompression_time
-            metrics[algorithm][file]['Real-time compression time'] = rt_compression_time
-            metrics[algorithm][file]['Processing'] = processing
-            metrics[algorithm][file]['Real-time'] = real_time
-            metrics[algorithm][file]['Cost'] = cost
+            for metric, column, column_type in columns:
+                if column in row and row[column] is not None:
+                    metrics[algorithm][file][metric] = self._from_column(row[column], column_type)
 
         return metrics
 
+    def _to_column(self, value, column_type):
+        if value is None:
+            return None
+        # SQLite has no boolean type, flags are stored as 0 or 1
+        return int(bool(value)) if column_type == 'BOOLEAN' else value
+
+    def _from_column(self, value, column_type):
+        if value is None:
+            return None
+        return value != 0 if column_type == 'BOOLEAN' else value
+
     def _get_most_recent_table(self):
         self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table';" )
         files = [result[0] for result in self.cursor.fetchall()]
@@ -0,0 +1,132 @@
+'''Scheduling of the measurements of a test run. Compression, decompression and random access decompression of the
+(file, algorithm) pairs are independent of each other, so they are run side by side in worker processes that are each pinned
+to their own core. Measurements that need the whole machine (real-time emulation, parallel compression) are left to the
+caller, which runs them one at a time.'''
+from multiprocessing import get_context, cpu_count
+from logging.handlers import QueueHandler, QueueListener
+from collections import namedtuple
+import filecmp
+import logging
+import os
+import timer
+import parallel
+
+measurement = namedtuple('measurement', 'algorithm module_path parameters input_path compressed_path decompressed_path random_access_records check_for_losslessness clean_after_use timing')
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(cpu_count()))
+
+class MeasurementScheduler:
+    def __init__(self, processes = 0):
+        # 0 runs one worker per available core
+        self.cores = available_cores()
+        self.processes = processes if processes > 0 else len(self.cores)
+
+    def run(self, measurements):
+        '''Generator of (measurement, metrics) in the order in which the measurements finish'''
+        if not measurements:
+            return
+
+        processes = min(self.processes, len(measurements))
+        # Spawned rather than forked, so workers do not inherit the plugin modules the test bench itself has loaded
+        context = get_context('spawn')
+        cores = context.Queue()
+        for i in range(processes):
+            cores.put(self.cores[i % len(self.cores)])
+
+        # Log records of the workers are handled by the handlers of the test bench process
+        log_records = context.Queue()
+        listener = QueueListener(log_records, *logging.getLogger().handlers, respect_handler_level=True)
+        listener.start()
+        try:
+            # Every measurement gets a new worker process, so it starts from freshly imported plugin modules: algorithms keep
+            # their parameters in module globals, which would otherwise carry over from the previous measurement in the same worker
+            with context.Pool(processes, initializer=_init_worker, initargs=(cores, log_records, logging.getLogger().getEffectiveLevel()), maxtasksperchild=1) as pool:
+                yield from pool.imap_unordered(_run, measurements)
+        finally:
+            listener.stop()
+
+# Worker process state, set up by _init_worker
+_cores = None
+
+def _init_worker(cores, log_records, log_level):
+    global _cores
+    _cores = cores
+    logger = logging.getLogger()
+    logger.handlers = [QueueHandler(log_records)]
+    logger.setLevel(log_level)
+
+def _run(job):
+    # A worker only lives for one measurement, so the core it is pinned to is handed back for the worker replacing it
+    core = _cores.get()
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {core})
+        return job, measure(job)
+    finally:
+        _cores.put(core)
+
+def measure(job):
+    module = parallel.load_module(job.module_path)
+    module.init(job.parameters)
+
+    # job.timing holds the keyword arguments of timer.repeat: warm-up runs, number of trials and the precision to stop at
+    logging.info('{}: starting full file compression of {}'.format(job.algorithm, job.input_path))
+    compression_time = timer.repeat(lambda : module.compress(job.input_path, job.compressed_path), **job.timing)
+    compression_ratio = os.path.getsize(job.compressed_path) / os.path.getsize(job.input_path)
+
+    logging.info('{}: starting full file decompression of {}'.format(job.algorithm, job.input_path))
+    decompression_time = timer.repeat(lambda : module.decompress(job.compressed_path, job.decompressed_path), **job.timing)
+
+    if job.check_for_losslessness:
+        lossless = filecmp.cmp(job.input_path, job.decompressed_path, False)
+    else:
+        lossless = True
+
+    logging.info('{}: starting random access decompression of {}'.format(job.algorithm, job.input_path))
+    random_access_decompression_time, random_access_lossless = random_access_decompression(module, job)
+
+    if job.clean_after_use:
+        os.remove(job.compressed_path)
+        os.remove(job.decompressed_path)
+
+    metrics = {
+        'Compression ratio' : compression_ratio,
+        'Losslessness' : lossless and random_access_lossless
+    }
+    metrics.update(timer.metrics('Compression time', compression_time))
+    metrics.update(timer.metrics('Decompression time', decompression_time))
+    metrics.update(timer.metrics('Random access decompression time', random_access_decompression_time))
+    metrics.update(timer.usage_metrics('Compression', compression_time.usage))
+    metrics.update(timer.usage_metrics('Decompression', decompression_time.usage))
+    metrics.update(timer.usage_metrics('Random access decompression', random_access_decompression_time.usage))
+    return metrics
+
+def random_access_decompression(module, job):
+    # Next to the compressed file, so measurements of other algorithms on the same file do not get in the way
+    output_paths = {record_id : job.compressed_path + '.ra_decompressed_{}'.format(record_id) for record_id in job.random_access_records}
+
+    def decompress_records():
+        for record_id, output_path in output_paths.items():
+            module.decompress(job.compressed_path, output_path, record_id)
+
+    # A trial decompresses every selected record once, the statistics are per record
+    timing = timer.per_operation(timer.repeat(decompress_records, **job.timing), len(output_paths))
+
+    lossless = []
+    for record_id, (file_offset, size) in job.random_access_records.items():
+        output_path = output_paths[record_id]
+        if job.check_for_losslessness:
+            # get the decompressed data
+            with open(job.input_path, 'rb') as original, open(output_path, 'rb') as decompressed:
+                decompressed_data = decompressed.read()
+                original.seek(file_offset)
+                original_data = original.read(size)
+                lossless.append(decompressed_data == original_data)
+
+        if job.clean_after_use:
+            os.remove(output_path)
+
+    return (timing, all(lossless))
@@ -4,18 +4,19 @@ import importlib
 import os
 import sys
 import timer
-import filecmp
 import shutil
 import time
 from gwf import File as gwf_file
 from collections import namedtuple
 import random
-import numpy
 import logging
 import visualizer
 import result_storage
 import pandas
 import command_line_parser
+import parallel
+import scheduler
+import replay
 
 class TestManager:
 
@@ -26,8 +27,8 @@ class TestManager:
         self.metrics = {}
         self.temporary_directory = './temp/'
         self.results_file = 'results.sqlite'
-        self.realtime = RealTimeEmulation()
-        self.random_access_records = None
+        self.realtime = RealTimeEmulation(self.config.get_metric_parameters().get('real-time cgroup'))
+        self.random_access_records = {}
         self.clean_after_use = True
         self.check_for_losslelssness = False
         self.file_info = {}
@@ -96,113 +97,130 @@ class TestManager:
         if not os.path.exists(self.temporary_directory):
                 os.makedirs(self.temporary_directory)
 
-        # for name, module, parameters in self.algorithms:
-        #     module.init(parameters)
-
+        measurements = []
+        timing = self._get_timing_parameters()
         for file in self.input_files:
-            logging.info('Starting on file {}'.format(file))
             meta_info = self.file_info[file]
 
-            logging.info('Starting on file {} which contains {} records over {} seconds'.format(file, len(meta_info.ping_numbers), meta_info.timespan))
+            logging.info('Scheduling file {} which contains {} records over {} seconds'.format(file, len(meta_info.ping_numbers), meta_info.timespan))
 
-            # Get file meta data
             # Select records for random access decompression
             self._get_random_access_records(file, meta_info.ping_numbers, 10)
             for name, module, parameters in self.algorithms:
-                logging.info('Algorithm {}'.format(name))
-
-                module.init(parameters)
-
-                # determine output file name and decompressed file name
-                compressed_path, decompressed_path, real_time_compressed_path = self._get_temporary_file_names(file, name)
+                compressed_path, decompressed_path, real_time_compressed_path, parallel_compressed_path = self._get_temporary_file_names(file, name)
+                measurements.append(scheduler.measurement(name, self.config.get_algorithm_module_path(name), parameters, file, compressed_path, decompressed_path,
+                                                          self.random_access_records[file], self.check_for_losslelssness, self.clean_after_use, timing))
 
-                # compress file meauring time
-                logging.info('Starting full file compression')
-                compression_time = self._compress(module, file, compressed_path)
-                compression_ratio = os.path.getsize(compressed_path) / os.path.getsize(file)
-                logging.info('Compression time {} seconds.'.format(compression_time))
-                logging.info('Compression ratio {}'.format(compression_ratio))
+        # Compression, decompression and random access decompression of all files and algorithms run side by side, each in a
+        # worker process on its own core. Results are merged as they come in
+        processes = int(self.config.get_metric_parameters('benchmark processes'))
+        available_memory = int(self.config.get_metric_parameters('acquisition memory available'))
+        for job, metrics in scheduler.MeasurementScheduler(processes).run(measurements):
+            logging.info('Algorithm {} on file {}: compression ratio {}, compression time {} seconds, decompression time {} seconds, random access decompression time {} seconds.'.format(
+                job.algorithm, job.input_path, metrics['Compression ratio'], metrics['Compression time'], metrics['Decompression time'], metrics['Random access decompression time']))
+            self.metrics.setdefault(job.algorithm, {}).setdefault(job.input_path, {}).update(metrics)
 
-                # decompress file measuring time
-                logging.info('Starting full file decompression')
-                decompression_time = self._decompress(module, compressed_path, decompressed_path)
-                logging.info('Decompression time {} seconds.'.format(decompression_time))
+            peak_memory = metrics.get('Compression peak memory (MB)')
+            if peak_memory is not None and peak_memory > available_memory:
+                logging.warning('Algorithm {} used {:.0f} MB compressing file {}, more than the {} MB available for acquisition.'.format(job.algorithm, peak_memory, job.input_path, available_memory))
 
+        # Real-time emulation and parallel compression need the whole machine, so they run one at a time once the other
+        # measurements are done
+        for file in self.input_files:
+            logging.info('Starting on file {}'.format(file))
+            for name, module, parameters in self.algorithms:
+                logging.info('Algorithm {}'.format(name))
 
-                if self.check_for_losslelssness:
-                    logging.info('Checking for losslessness')
-                    lossless = filecmp.cmp(file, decompressed_path, False)
-                else:
-                    lossless = True
+                module.init(parameters)
+                compressed_path, decompressed_path, real_time_compressed_path, parallel_compressed_path = self._get_temporary_file_names(file, name)
 
-                # random access decompression
-                logging.info('Starting random access decompression')
-                random_access_decompression_time, random_access_lossless = self.random_access_compression(module,file, compressed_path)
-                logging.info('Random access decompression time {} seconds.'.format(random_access_decompression_time))
+                # compress the records of the file in parallel measuring wall time
+                if parallel.supports_parallel_compression(module):
+                    logging.info('Starting parallel compression')
+                    parallel_compression_time = self._compress_parallel(name, module, parameters, file, parallel_compressed_path, timing)
+                    logging.info('Parallel compression time {} seconds.'.format(parallel_compression_time.mean))
+                    self.metrics[name][file].update(timer.metrics('Parallel compression time', parallel_compression_time))
+                    self.metrics[name][file].update(timer.usage_metrics('Parallel compression', parallel_compression_time.usage))
 
                 # real time stuff
                 logging.info('Starting real time compression')
-                realtime_compression_time = self._compress_real_time(module, file, real_time_compressed_path)
-                logging.info('Real time compression time {} seconds.'.format(realtime_compression_time))
-
-                if name not in self.metrics:
-                    self.metrics[name] = {}
-
-                metrics = {
-                'Compression ratio' : compression_ratio,
-                'Compression time' : compression_time,
-                'Decompression time' : decompression_time,
-                'Losslessness' : lossless and random_access_lossless,
-                'Random access decompression time' : random_access_decompression_time,
-                'Real-time compression time' : realtime_compression_time
-                }
-
-                self.metrics[name][file] = metrics
+                realtime_compression_usage = self._compress_real_time(module, file, real_time_compressed_path)
+                if realtime_compression_usage is None:
+                    # Out of memory, the compression never finishes
+                    self.metrics[name][file]['Real-time compression time'] = float('inf')
+                else:
+                    self.metrics[name][file]['Real-time compression time'] = realtime_compression_usage.wall
+                    self.metrics[name][file].update(timer.usage_metrics('Real-time compression', realtime_compression_usage))
+                logging.info('Real time compression time {} seconds.'.format(self.metrics[name][file]['Real-time compression time']))
+
+                # ping by ping at the rate of the echosounder, which needs records that are compressed independently
+                if parallel.supports_parallel_compression(module):
+                    logging.info('Starting real-time replay')
+                    replay_metrics = self._replay(module, file, real_time_compressed_path)
+                    if replay_metrics:
+                        logging.info('Real-time replay: {} of {} second deadlines missed, 99th percentile latency {} seconds, backlog up to {} pings.'.format(
+                            replay_metrics['Replay missed deadlines'], replay_metrics['Replay deadline'], replay_metrics['Replay latency p99'], replay_metrics['Replay backlog max']))
+                    self.metrics[name][file].update(replay_metrics)
 
                 if self.clean_after_use:
-                    os.remove(compressed_path)
-                    os.remove(decompressed_path)
                     os.remove(real_time_compressed_path)
+                    if os.path.exists(parallel_compressed_path):
+                        os.remove(parallel_compressed_path)
 
         if self.clean_after_use:
             self._cleanup()
 
 
-    def _compress(self, module, input_path, output_path):
-        return timer.time_process(lambda : module.compress(input_path, output_path))
+    def _compress_parallel(self, algorithm, module, parameters, input_path, output_path, timing):
+        # Wall time, the work is done in the worker processes. Starting the pool is not part of the measurement
+        processes = int(self.config.get_metric_parameters('parallel compression processes'))
+        worker_counters = []
+        with parallel.CompressionPool(self.config.get_algorithm_module_path(algorithm), parameters, input_path, processes) as pool:
+            parallel_compression_time = timer.repeat(lambda : worker_counters.append(pool.compress(module, output_path)), time.perf_counter, **timing)
 
+        # The CPU time and I/O of the workers, averaged over the timed trials like the usage of the test bench process itself
+        counters = timer.counter_mean(worker_counters[-parallel_compression_time.trials:])
+        return parallel_compression_time._replace(usage=timer.add_worker_usage(parallel_compression_time.usage, counters))
 
-    def _decompress(self, module, input_path, output_path):
-        return timer.time_process(lambda : module.decompress(input_path, output_path))
+    def _get_timing_parameters(self):
+        # Keyword arguments of timer.repeat
+        return {
+            'warmup' : int(self.config.get_metric_parameters('timing warm-up runs')),
+            'min_trials' : int(self.config.get_metric_parameters('timing minimum trials')),
+            'max_trials' : int(self.config.get_metric_parameters('timing maximum trials')),
+            'relative_precision' : float(self.config.get_metric_parameters('timing relative precision'))
+        }
 
 
     def _compress_real_time(self, module, input_path, output_path):
+        # The resources are measured in the confined process itself, its I/O and peak memory are not visible from here.
+        # Returns None when the compression does not fit in the memory available for acquisition
         available_cpu = int(self.config.get_metric_parameters('acquisition cpu available'))
         available_memory = int(self.config.get_metric_parameters('acquisition memory available'))
-        return self.realtime.time(lambda : module.compress(input_path, output_path), time.perf_counter, available_cpu, available_memory)
+        try:
+            return self.realtime.run(lambda : timer.usage(lambda : module.compress(input_path, output_path)), available_cpu, available_memory)
+        except MemoryError:
+            logging.warning('Compression does not fit in the {} MB available for acquisition'.format(available_memory))
+            return None
 
 
-    def random_access_compression(self, module, original_file, compressed_file):
-        name = os.path.splitext(os.path.split(original_file)[1])[0]
-        times = []
-        lossless = []
-
-        for record_id, (file_offset, size) in self.random_access_records.items():
-            output_path = os.path.join(self.temporary_directory, name + '.ra_decompressed_{}'.format(record_id))
-            times.append(timer.time_process(lambda : module.decompress(compressed_file, output_path, record_id)))
-
-            if self.check_for_losslelssness:
-                # get the decompressed data
-                with open(original_file, 'rb') as original, open(output_path, 'rb') as decompressed:
-                    decompressed_data = decompressed.read()
-                    original.seek(file_offset)
-                    original_data = original.read(size)
-                    lossless.append(decompressed_data == original_data)
+    def _replay(self, module, input_path, output_path):
+        available_cpu = int(self.config.get_metric_parameters('acquisition cpu available'))
+        available_memory = int(self.config.get_metric_parameters('acquisition memory available'))
+        duration = float(self.config.get_metric_parameters('real-time replay duration'))
+        deadline = float(self.config.get_metric_parameters('real-time replay deadline'))
 
-            if self.clean_after_use:
-                os.remove(output_path)
+        def replay_and_measure():
+            metrics = {}
+            usage = timer.usage(lambda : metrics.update(replay.replay(module, input_path, output_path, duration, deadline)))
+            metrics.update(timer.usage_metrics('Real-time replay', usage))
+            return metrics
 
-        return (numpy.average(times), all(lossless))
+        try:
+            return self.realtime.run(replay_and_measure, available_cpu, available_memory)
+        except MemoryError:
+            logging.warning('Real-time replay does not fit in the {} MB available for acquisition'.format(available_memory))
+            return {}
 
 
     def _get_temporary_file_names(self, orignial, algorithm_name):
@@ -213,7 +231,8 @@ class TestManager:
         compressed = os.path.join(dir, name + '.compressed')
         decompressed = os.path.join(dir, name + '.decompressed')
         compressed_rt = os.path.join(dir, name + '.compressed_rt')
-        return (compressed, decompressed, compressed_rt)
+        compressed_parallel = os.path.join(dir, name + '.compressed_parallel')
+        return (compressed, decompressed, compressed_rt, compressed_parallel)
 
     def _cleanup(self):
         shutil.rmtree(self.temporary_directory)
@@ -231,9 +250,9 @@ class TestManager:
     def _get_file_meta_data(self, file):
         logging.info('Reading input file meta data for file {}'.format(file))
         meta_info = namedtuple('meta_info', 'timespan ping_numbers path size')
-        gwf = gwf_file(file)
-        record_info = [(wc.ping_number, wc.ping_time_seconds + (wc.ping_time_micro_seconds / 1E6)) for wc in gwf.read()]
-        ping_numbers, generation_times = zip(*record_info)
+        index = gwf_file(file).index()
+        ping_numbers = tuple(index.entries['ping_number'].tolist())
+        generation_times = index.times
         size = os.path.getsize(file)
         info = meta_info(timespan = generation_times[len(generation_times) -1] - generation_times[0], ping_numbers = ping_numbers, path=file, size=size)
         logging.info("{}: {} MB. {} records over {} seconds".format(file, info.size / 1024**2, len(info.ping_numbers), info.timespan))
@@ -241,8 +260,11 @@ class TestManager:
 
     def _get_random_access_records(self, file, records_in_file, number_of_records_to_select):
         records = random.sample(records_in_file, number_of_records_to_select)
-        gwf = gwf_file(file)
-        self.random_access_records = { wc.ping_number : (wc.file_offset, wc.size) for wc in gwf.read() if wc.ping_number in records}
+        index = gwf_file(file).index()
+        self.random_access_records[file] = {}
+        for record in records:
+            entry = index.find(record)
+            self.random_access_records[file][record] = (int(entry['file_offset']), int(entry['size']))
 
     def _compute_derived_metrics(self):
         algorithms = self.metrics.keys()
@@ -269,6 +291,12 @@ class TestManager:
                     self.metrics[algorithm][file]['Processing'] = processing_metric
                     self.metrics[algorithm][file]['Cost'] = cost_metric
 
+                    # Both wall times: compression time itself is CPU time, which does not show the work being spread over cores
+                    parallel_compression_time = self.metrics[algorithm][file].get('Parallel compression time')
+                    compression_wall_time = self.metrics[algorithm][file].get('Compression wall time')
+                    if parallel_compression_time and compression_wall_time:
+                        self.metrics[algorithm][file]['Parallel speedup'] = compression_wall_time / parallel_compression_time
+
     def _computeRealTimeMetric(self, file_meta_info, real_time_compression_time):
         number_of_records_in_file = len(file_meta_info.ping_numbers)
         file_timespan = file_meta_info.timespan
@@ -1,4 +1,15 @@
 import time
+import math
+import os
+import sys
+import statistics
+from collections import namedtuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not measured
+    resource = None
 
 def time_process(f):
     return timer(f, time.process_time)
@@ -11,3 +22,166 @@ def timer(f, t):
     f()
     return t() - before
 
+# Statistics of repeated timings of one operation. The mean is the value of the metric itself, the other statistics are
+# stored next to it as "<metric> <statistic>"
+timing_statistics = namedtuple('timing_statistics', 'mean min median stddev ci_low ci_high trials usage')
+statistic_names = [('min', 'min'), ('median', 'median'), ('stddev', 'stddev'), ('ci_low', 'CI low'), ('ci_high', 'CI high'), ('trials', 'trials')]
+
+# Two-sided 95% quantiles of Student's t distribution for 1 to 30 degrees of freedom. Beyond that the normal quantile is close enough
+_t_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# Resources used by an operation: wall, user and system CPU time in seconds (the CPU times include threads and child
+# processes that were waited for), peak resident set size in bytes and bytes read and written (/proc/self/io rchar and
+# wchar). Values that cannot be measured on the platform are None
+resource_usage = namedtuple('resource_usage', 'wall user system peak_rss read_bytes written_bytes')
+usage_names = [('wall', 'wall time'), ('user', 'user time'), ('system', 'system time'), ('peak_rss', 'peak memory (MB)'), ('read_bytes', 'bytes read'), ('written_bytes', 'bytes written')]
+
+def repeat(f, t = time.process_time, warmup = 1, min_trials = 3, max_trials = 10, relative_precision = 0.02):
+    '''
+    Time f with clock t over a number of trials. The first warmup calls are not timed, they take page cache misses, imports
+    and other one-off costs out of the measurement. After that f is timed at least min_trials and at most max_trials times,
+    stopping as soon as the 95% confidence interval of the mean is within relative_precision of the mean.
+    '''
+    for i in range(warmup):
+        f()
+
+    samples = []
+    usages = []
+    while len(samples) < max(max_trials, 1):
+        elapsed, trial_usage = _trial(f, t)
+        samples.append(elapsed)
+        usages.append(trial_usage)
+        if len(samples) >= max(min_trials, 2) and _half_width(samples) <= relative_precision * statistics.mean(samples):
+            break
+    return statistics_of(samples, _combine_usage(usages))
+
+def usage(f):
+    '''Resources used by a single call of f'''
+    return _trial(f, time.perf_counter)[1]
+
+def process_counters():
+    '''CPU time (user, system) and I/O (bytes read, bytes written) of this process so far. Worker processes that are not
+    waited for report the differences of these, so their share can be added with add_worker_usage'''
+    times = os.times()
+    io = _io_counters() or (None, None)
+    return (times.user, times.system) + tuple(io)
+
+def counter_difference(before, after):
+    return tuple(_combine(a, b, lambda a, b: b - a) for a, b in zip(before, after))
+
+def counter_sum(first, second):
+    return tuple(_combine(a, b, lambda a, b: a + b) for a, b in zip(first, second))
+
+def counter_mean(counters):
+    return tuple(None if any(value is None for value in values) else statistics.mean(values) for values in zip(*counters))
+
+def add_worker_usage(usage, counters):
+    '''usage with the CPU time and I/O of worker processes (summed differences of process_counters) added to it. Peak memory
+    stays that of this process'''
+    user, system, read_bytes, written_bytes = counter_sum((usage.user, usage.system, usage.read_bytes, usage.written_bytes), counters)
+    return usage._replace(user=user, system=system, read_bytes=read_bytes, written_bytes=written_bytes)
+
+def statistics_of(samples, usage = None):
+    mean = statistics.mean(samples)
+    half_width = _half_width(samples) if len(samples) > 1 else float('nan')
+    stddev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    return timing_statistics(mean, min(samples), statistics.median(samples), stddev, mean - half_width, mean + half_width, len(samples), usage)
+
+def per_operation(timing, operations):
+    '''Statistics of a trial that consists of a number of operations, expressed per operation'''
+    timing = timing._replace(**{field: getattr(timing, field) / operations for field in timing._fields if field not in ('trials', 'usage')})
+    if timing.usage is not None:
+        # Peak memory is a maximum, not a sum over the operations
+        timing = timing._replace(usage=timing.usage._replace(**{field: None if getattr(timing.usage, field) is None else getattr(timing.usage, field) / operations
+                                                                 for field in timing.usage._fields if field != 'peak_rss'}))
+    return timing
+
+def metrics(name, timing):
+    '''Entries of a metrics dictionary for the timing statistics of metric name'''
+    result = {name : timing.mean}
+    for field, statistic in statistic_names:
+        result['{} {}'.format(name, statistic)] = getattr(timing, field)
+    return result
+
+def usage_metrics(phase, usage):
+    '''Entries of a metrics dictionary for the resources used in phase (e.g. "Compression")'''
+    result = {}
+    for field, name in usage_names:
+        value = getattr(usage, field)
+        if field == 'peak_rss' and value is not None:
+            value /= 1024**2
+        result['{} {}'.format(phase, name)] = value
+    return result
+
+def is_statistic(metric):
+    return any(metric.endswith(' ' + statistic) for field, statistic in statistic_names)
+
+def _half_width(samples):
+    degrees_of_freedom = len(samples) - 1
+    t = _t_95[degrees_of_freedom - 1] if degrees_of_freedom <= len(_t_95) else 1.96
+    return t * statistics.stdev(samples) / math.sqrt(len(samples))
+
+def _trial(f, t):
+    _reset_peak_rss()
+    children_peak_rss = _children_peak_rss()
+    io_before = _io_counters()
+    times_before = os.times()
+    wall_before = time.perf_counter()
+    before = t()
+    f()
+    elapsed = t() - before
+    wall = time.perf_counter() - wall_before
+    times_after = os.times()
+    io_after = _io_counters()
+
+    user = (times_after.user + times_after.children_user) - (times_before.user + times_before.children_user)
+    system = (times_after.system + times_after.children_system) - (times_before.system + times_before.children_system)
+    peak_rss = _peak_rss()
+    if _children_peak_rss() not in (None, children_peak_rss):
+        # A child process that ended during f used more memory than any before it
+        peak_rss = max(peak_rss or 0, _children_peak_rss())
+    read_bytes, written_bytes = (None, None) if io_before is None or io_after is None else (io_after[0] - io_before[0], io_after[1] - io_before[1])
+    return elapsed, resource_usage(wall, user, system, peak_rss, read_bytes, written_bytes)
+
+def _combine(a, b, function):
+    return None if a is None or b is None else function(a, b)
+
+def _combine_usage(usages):
+    # Averages over the trials, except for the peak memory which is the highest of all trials
+    def combine(values, combine_function):
+        return None if any(value is None for value in values) else combine_function(values)
+    return resource_usage(*[combine([getattr(usage, field) for usage in usages], max if field == 'peak_rss' else statistics.mean) for field in resource_usage._fields])
+
+def _reset_peak_rss():
+    # Resets VmHWM of the process on Linux. Elsewhere the peak is that of the process so far
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _max_rss(resource.RUSAGE_SELF) if resource else None
+
+def _children_peak_rss():
+    return _max_rss(resource.RUSAGE_CHILDREN) if resource else None
+
+def _max_rss(who):
+    # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+    return resource.getrusage(who).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+def _io_counters():
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
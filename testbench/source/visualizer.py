@@ -3,6 +3,7 @@ from matplotlib import pyplot as plt
 import os
 import numpy as np
 import math
+import timer
 
 #def _vizualize_metric(result):
 #    for file, algorithms:
@@ -10,10 +11,17 @@ import math
 
 def visualize(result):
     restructured_results = {}
+    # Confidence intervals of timed metrics, drawn as error bars
+    intervals = {}
 
     for algorithm, file_results in result.items():
         for file, metrics in file_results.items():
             for metric, value in metrics.items():
+                # Statistics are drawn as error bars of their metric, metrics that could not be measured on this platform are left out
+                if timer.is_statistic(metric) or value is None:
+                    continue
+                if '{} CI low'.format(metric) in metrics and '{} CI high'.format(metric) in metrics:
+                    intervals.setdefault(metric, {})[(os.path.split(file)[1],algorithm)] = (metrics['{} CI low'.format(metric)], metrics['{} CI high'.format(metric)])
                 if metric not in restructured_results:
                     restructured_results[metric] = {}
                 # if file not in restructured_results[metric]:
@@ -35,7 +43,13 @@ def visualize(result):
         width = 1 / (number_of_bars_per_group + 1)
         pos = [[i + width * algorithm_index for i in range(number_of_bar_groups)] for algorithm_index in range(len(algorithms))]
 
-        values = [[metric_results[(file, algorithms[algorithm_index])] for file in files] for algorithm_index in range(len(algorithms))]
+        # Not every algorithm provides every metric, missing values are left out of the chart
+        values = [[metric_results.get((file, algorithms[algorithm_index]), float('nan')) for file in files] for algorithm_index in range(len(algorithms))]
+        errors = None
+        if metric in intervals:
+            # Distance from the mean to the bounds of the interval, below and above
+            bounds = [[intervals[metric].get((file, algorithm), (float('nan'), float('nan'))) for file in files] for algorithm in algorithms]
+            errors = [[[value - low for value, (low, high) in zip(values[i], bounds[i])], [high - value for value, (low, high) in zip(values[i], bounds[i])]] for i in range(len(algorithms))]
 
         fig, ax = plt.subplots(figsize = (20,5))
 
@@ -55,9 +69,14 @@ def visualize(result):
                     # with color
                     color=colors[i],
                     # with label the first value in first_name
-                    label=algorithms[i])
+                    label=algorithms[i],
+                    # with the confidence interval of timed metrics
+                    yerr=errors[i] if errors else None,
+                    capsize=3)
 
             for position,value in zip(pos[i], values[i]):
+                if math.isnan(value):
+                    continue
                 ax.text(position - width/2, value, '{:.3g}'.format(value), color=colors[i])
 
         if metric == "Cost":
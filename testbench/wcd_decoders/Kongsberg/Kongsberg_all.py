@@ -1,10 +1,19 @@
 import os
+import mmap
 import struct
 import logging
 import datetime
+import numpy as np
 from collections import OrderedDict
 from copy import deepcopy
 from .wcd_congregator import *
+from .. import sidecar_index
+
+# One entry per datagram in a Kongsberg file
+kongsberg_index_dtype = np.dtype([('offset', '<u8'),
+                                  ('size', '<u4'),
+                                  ('packet_type', 'u1'),
+                                  ('model_number', '<u2')])
 
 class KongsbergPingTime:
     def __init__(self, date, time):
@@ -20,18 +29,15 @@ class KongsbergPingTime:
         self.sec
 
 class KongsbergPacket:
-    def __init__(self, fin):
-
-        temp = fin.read(8)
-        if not temp or len(temp) != 8:
-            raise ValueError("This should really be a different exception type. Reading packet failed")
+    header_fmt = '<IBBH'
 
-        unpacked = struct.unpack('<IBBH', temp);
+    def __init__(self, data):
+        # data is the complete datagram, typically a memoryview into the mapped file
+        unpacked = struct.unpack_from(self.header_fmt, data)
         self.size = unpacked[0] + 4
         self.packet_type = unpacked[2]
         self.model_number = unpacked[3]
-        fin.seek(-8, 1)
-        self.data = fin.read(self.size)
+        self.data = data
 
     def raw_data(self):
         return self.data
@@ -54,32 +60,52 @@ class KongsbergWaterColumnTxSector:
         return "Sector {}:\n".format(self.sector_number) + "\n".join([ "\t{}: {}".format(key, value) for key, value in variables.items()]) + "\n"
 
 class KongsbergWaterColumnbeam:
-    def __init__(self, data):
-        self.header_fmt = '<hHHHBB'
-        unpacked = struct.unpack(self.header_fmt, data[:struct.calcsize(self.header_fmt)])
-        self.beam_angle = unpacked[0] * 0.01
-        self.start_range_sample_number = unpacked[1]
-        self.number_of_samples = unpacked[2]
-        self.detection_range = unpacked[3]
-        self.transmit_sector = unpacked[4]
-        self.beam_number = unpacked[5]
-        self.binary_header = data[:struct.calcsize(self.header_fmt)]
-        self.samples = data[struct.calcsize(self.header_fmt) : struct.calcsize(self.header_fmt) + self.number_of_samples ]
-
-        #index = struct.calcsize(self.header_fmt)
-        # for i in range(self.number_of_samples):
-        #     fmt = '<b'
-        #     self.samples.append(struct.unpack(fmt, data[index:index+struct.calcsize(fmt)])[0])
-        #     index += struct.calcsize(fmt)
+    header_fmt = '<hHHHBB'
+    header_dtype = np.dtype([('beam_angle', '<i2'),
+                             ('start_range_sample_number', '<u2'),
+                             ('number_of_samples', '<u2'),
+                             ('detection_range', '<u2'),
+                             ('transmit_sector', 'u1'),
+                             ('beam_number', 'u1')])
+
+    def __init__(self, headers, index, binary_header, samples):
+        # headers is the beam header array of the packet and index the position of this beam in it. binary_header and samples are
+        # views on the datagram
+        self.headers = headers
+        self.index = index
+        self.binary_header = binary_header
+        self.samples = samples
+
+    @property
+    def beam_angle(self):
+        return self.headers['beam_angle'][self.index] * 0.01
+
+    @property
+    def start_range_sample_number(self):
+        return self.headers['start_range_sample_number'][self.index]
+
+    @property
+    def number_of_samples(self):
+        return self.headers['number_of_samples'][self.index]
+
+    @property
+    def detection_range(self):
+        return self.headers['detection_range'][self.index]
+
+    @property
+    def transmit_sector(self):
+        return self.headers['transmit_sector'][self.index]
+
+    @property
+    def beam_number(self):
+        return self.headers['beam_number'][self.index]
 
     def calcsize(self):
         return struct.calcsize(self.header_fmt) + len(self.samples)
 
     def __str__(self):
-        variables = deepcopy(vars(self))
-        del variables['header_fmt']
-        del variables['samples']
-        return "\n".join([ "\t{}: {}".format(key, value) for key, value in variables.items()]) + "\n"
+        variables = ['beam_angle', 'start_range_sample_number', 'number_of_samples', 'detection_range', 'transmit_sector', 'beam_number']
+        return "\n".join([ "\t{}: {}".format(variable, getattr(self, variable)) for variable in variables]) + "\n"
 
     def get_amplitude_samples(self):
         return self.samples;
@@ -128,15 +154,50 @@ class KongsbergWaterColumnPacket:
             self.tx_sectors.append(sector)
             index += sector.calcsize()
 
-        self.binary_header = packet.data[:index]
+        self.binary_header = bytes(packet.data[:index])
 
-        for i in range(self.header['number of beams in packet']):
-            beam = KongsbergWaterColumnbeam(packet.data[index:])
-            self.beams.append(beam)
-            index += beam.calcsize()
+        index = self._parse_beams(memoryview(packet.data), index)
 
         self.binary_header += packet.data[index:]
 
+    def _parse_beams(self, data, index):
+        # Beams are variable length, so we hop over them once to find where each of them starts. All beam headers are then
+        # gathered into one structured array in a single numpy operation, samples stay views on the datagram
+        beam_header_size = struct.calcsize(KongsbergWaterColumnbeam.header_fmt)
+        number_of_samples = struct.Struct('<H')
+        number_of_samples_offset = KongsbergWaterColumnbeam.header_dtype.fields['number_of_samples'][1]
+        offsets = []
+        for i in range(self.header['number of beams in packet']):
+            offsets.append(index)
+            index += beam_header_size + number_of_samples.unpack_from(data, index + number_of_samples_offset)[0]
+
+        raw = np.frombuffer(data, dtype=np.uint8)
+        header_bytes = raw[np.array(offsets, dtype=np.intp)[:, np.newaxis] + np.arange(beam_header_size)]
+        self.beam_headers = header_bytes.view(KongsbergWaterColumnbeam.header_dtype).reshape(len(offsets))
+
+        sample_counts = self.beam_headers['number_of_samples'].tolist()
+        self.beams = [KongsbergWaterColumnbeam(self.beam_headers, i, data[offset:offset + beam_header_size], data[offset + beam_header_size:offset + beam_header_size + count])
+                      for i, (offset, count) in enumerate(zip(offsets, sample_counts))]
+        return index
+
+    def merge(self, sub_packets):
+        # Add the beams of the other datagrams of the same ping to this packet. Beam headers and beams are copied into arrays
+        # sized for the complete ping, rather than growing a list per datagram
+        packets = [self] + list(sub_packets)
+        number_of_beams = sum(len(packet.beams) for packet in packets)
+        beam_headers = np.empty(number_of_beams, dtype=KongsbergWaterColumnbeam.header_dtype)
+        beams = [None] * number_of_beams
+        start = 0
+        for packet in packets:
+            end = start + len(packet.beams)
+            beam_headers[start:end] = packet.beam_headers
+            beams[start:end] = packet.beams
+            start = end
+
+        self.beam_headers = beam_headers
+        self.beams = beams
+        self.header['number of bytes in datagram'] += sum(packet.header['number of bytes in datagram'] for packet in packets[1:])
+
     def __str__(self):
         r = ""
         for k,v in self.header.items():
@@ -177,34 +238,68 @@ class KongsbergWaterColumnPacket:
         return self.header['ping_time']
 
 class reader_kongsberg:
+    index_extension = '.kmidx'
+
     def __init__(self, path : str):
         self.path = path
-        self.bytesRead = 0
         self.size = os.path.getsize(path)
-
-    def packets(self):
-        try:
-            while self.bytesRead < self.size:
-                packet = KongsbergPacket(self.fin)
-                self.bytesRead += packet.size
-                yield packet
-        except ValueError as e:
-            logging.error(e)
-            pass
+        self.fin = None
+        self.buffer = None
+        self._index = None
+
+    def datagrams(self):
+        '''Generator of (type, offset, size) tuples for all datagrams in the file. Only datagram headers are read'''
+        for offset, size, packet_type, model_number in self._scan():
+            yield packet_type, offset, size
+
+    def index(self):
+        if self._index is None:
+            self._index = sidecar_index.load_or_build(self.path, self.index_extension, b'KMAI', kongsberg_index_dtype, lambda: list(self._scan()))
+        return self._index
+
+    def packet(self, offset, size):
+        return KongsbergPacket(self.buffer[offset:offset + size])
+
+    def packets(self, packet_type=None):
+        index = self.index()
+        if packet_type != None:
+            index = index[index['packet_type'] == packet_type]
+        for offset, size in zip(index['offset'].tolist(), index['size'].tolist()):
+            yield self.packet(offset, size)
 
     def open(self):
         self.fin = open(self.path, 'rb')
+        self.size = os.fstat(self.fin.fileno()).st_size
+        if self.size == 0:
+            self.buffer = memoryview(b'')
+        else:
+            self.buffer = memoryview(mmap.mmap(self.fin.fileno(), 0, access=mmap.ACCESS_READ))
 
     def close(self):
+        # Packets handed out keep a view on the mapping, it is unmapped once the last of them is gone
+        self.buffer = None
         self.fin.close()
 
+    def _scan(self):
+        header = struct.Struct(KongsbergPacket.header_fmt)
+        offset = 0
+        while offset + header.size <= self.size:
+            length, stx, packet_type, model_number = header.unpack_from(self.buffer, offset)
+            size = length + 4
+            if offset + size > self.size:
+                logging.error('Truncated datagram at offset {} in {}'.format(offset, self.path))
+                break
+            yield offset, size, packet_type, model_number
+            offset += size
+
 
 class KongsbergAllParser:
+    water_column_datagram_type = 107
+
     def __init__(self):
         self.path = None
         self.parser = None
-        self.wc_generator = None
-        self.first_wc_packet = None
+        self.wc_index = None
 
     def GetSupportedExtensions(self):
         return ['.all', '.wcd']
@@ -213,42 +308,27 @@ class KongsbergAllParser:
         self.path = path
         self.parser = reader_kongsberg(path)
         self.parser.open()
-        self.wc_generator = (packet for packet in self.parser.packets() if packet.packet_type == 107)
+        index = self.parser.index()
+        self.wc_index = index[index['packet_type'] == self.water_column_datagram_type]
 
     def Close(self):
         self.parser.close()
         self.path = None
         self.parser = None
-        self.wc_generator = None
-        self.first_wc_packet = None
-
+        self.wc_index = None
 
     def ContainsWcd(self):
-        if self.first_wc_packet == None:
-            self._FindWcPacket()
+        if self.wc_index is None:
+            raise ValueError
 
-        return self.first_wc_packet != None
+        return len(self.wc_index) > 0
 
     def GetMakeAndModel(self):
-        if self.first_wc_packet == None:
-            self._FindWcPacket()
-
-        if self.first_wc_packet == None:
+        if not self.ContainsWcd():
+            logging.debug("No water column data in {}".format(self.path))
             return ("None", "None")
 
-        return ("Kongsberg", "{}".format(self.first_wc_packet.model_number))
-
-
-    def _FindWcPacket(self):
-        if self.wc_generator == None:
-            raise ValueError
-
-        if self.first_wc_packet == None:
-            try:
-                self.first_wc_packet = next(self.wc_generator)
-            except StopIteration:
-                logging.debug("No water column data in {}".format(self.path))
-                pass
+        return ("Kongsberg", "{}".format(self.wc_index[0]['model_number']))
 
     def water_column_packets(self):
-        return congregate(KongsbergWaterColumnPacket(packet) for packet in self.parser.packets() if packet.packet_type == 107)
+        return congregate(KongsbergWaterColumnPacket(self.parser.packet(offset, size)) for offset, size in zip(self.wc_index['offset'].tolist(), self.wc_index['size'].tolist()))
@@ -1,28 +1,47 @@
 '''Take a generator of water column packets and turn it into a generator for congregated water column packets'''
-from collections import defaultdict
-def congregate(wcd_generator, allow_incomplete = True):
-    ping_number_per_head = defaultdict(int)
-    sub_packets_per_head = defaultdict(list)
+import datetime
+import logging
+from collections import OrderedDict
+
+def congregate(wcd_generator, allow_incomplete = True, max_datagrams_per_ping = 64, timeout = 2.0):
+    '''
+    Sub-datagrams are buffered per head (serial number) until their ping is complete. A buffered ping is flushed when all its
+    beams are in, when the next ping of the same head starts, when max_datagrams_per_ping datagrams have been buffered for
+    it, when it is more than timeout seconds (ping time) older than the latest packet, or when the input runs out. Memory
+    use is therefore bounded by the number of heads, whatever the input looks like.
+    '''
+    timeout = datetime.timedelta(seconds=timeout)
+    pending = OrderedDict()
     for packet in wcd_generator:
         serial_number = packet.header['serial_number']
-        ping_number = ping_number_per_head[serial_number]
-        sub_packets = sub_packets_per_head[serial_number]
-        if packet.header['ping_number'] != ping_number:
-            if len(sub_packets) > 0:
-                ping = sub_packets[0]
-                for sub_packet in sub_packets[1:]:
-                    ping.beams += sub_packet.beams
-                    ping.header['number of bytes in datagram'] += sub_packet.header['number of bytes in datagram']
+        sub_packets = pending.get(serial_number)
+        if sub_packets and sub_packets[0].header['ping_number'] != packet.header['ping_number']:
+            yield from _flush(pending.pop(serial_number), allow_incomplete)
+            sub_packets = None
+
+        if sub_packets is None:
+            sub_packets = pending[serial_number] = []
+        sub_packets.append(packet)
+
+        if _number_of_beams(sub_packets) >= packet.header['total number of receive beams'] or len(sub_packets) >= max_datagrams_per_ping:
+            yield from _flush(pending.pop(serial_number), allow_incomplete)
 
-                if len(ping.beams) == ping.header['total number of receive beams'] or allow_incomplete:
-                    yield ping
-                else:
-                    print('Incomplete ping with number {} only have {} of {} beams'.format(ping_number, len(ping.beams), ping.header['total number of receive beams']))
+        ping_time = packet.header['ping_time']
+        for stale_serial_number in [serial for serial, buffered in pending.items() if ping_time - buffered[0].header['ping_time'] > timeout]:
+            yield from _flush(pending.pop(stale_serial_number), allow_incomplete)
 
-            sub_packets_per_head[serial_number] = [packet]
-            ping_number_per_head[serial_number] = packet.header['ping_number']
+    for sub_packets in pending.values():
+        yield from _flush(sub_packets, allow_incomplete)
 
-        elif packet.header['ping_number'] == ping_number:
-            sub_packets_per_head[serial_number].append(packet)
+def _number_of_beams(sub_packets):
+    return sum(sub_packet.header['number of beams in packet'] for sub_packet in sub_packets)
 
+def _flush(sub_packets, allow_incomplete):
+    ping = sub_packets[0]
+    if len(sub_packets) > 1:
+        ping.merge(sub_packets[1:])
 
+    if len(ping.beams) == ping.header['total number of receive beams'] or allow_incomplete:
+        yield ping
+    else:
+        logging.warning('Incomplete ping with number {} only have {} of {} beams'.format(ping.header['ping_number'], len(ping.beams), ping.header['total number of receive beams']))
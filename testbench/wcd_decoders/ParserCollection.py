@@ -2,18 +2,36 @@ import sys
 import os
 import logging
 import sqlite3
+import importlib
 from collections import namedtuple
 from .Kongsberg.Kongsberg_all import KongsbergAllParser
 from .Reson.Reson_s7k import Reson7kParser
-from .QPS.db_reader import DbReader
-from .R2Sonic.Reader import R2sReader
 
 water_column_file = namedtuple('water_column_file', 'path size manufacturer device')
 
+# Parsers that are not part of every checkout: module relative to this package, parser class. When the module is missing
+# its files are not recognised as water column files
+_optional_parsers = [('.QPS.db_reader', 'DbReader'), ('.R2Sonic.Reader', 'R2sReader')]
+
+_missing_parsers = set()
+
+def _load_optional_parsers():
+    parsers = []
+    for module_name, class_name in _optional_parsers:
+        try:
+            module = importlib.import_module(module_name, __package__)
+        except ImportError as e:
+            if class_name not in _missing_parsers:
+                logging.warning('Parser {} is not available ({}), its files are skipped'.format(class_name, e))
+                _missing_parsers.add(class_name)
+            continue
+        parsers.append(getattr(module, class_name)())
+    return parsers
+
 class WcdParserCollection:
     def __init__(self):
         self.parsers = {}
-        parsers = [Reson7kParser(), KongsbergAllParser(), DbReader(), R2sReader()]
+        parsers = [Reson7kParser(), KongsbergAllParser()] + _load_optional_parsers()
         for parser in parsers:
             for ext in parser.GetSupportedExtensions():
                 self.parsers[ext] = parser
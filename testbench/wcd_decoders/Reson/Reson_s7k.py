@@ -1,15 +1,12 @@
-import os
 from .reader import S7kFrameReader
 import numpy as np
-import struct
 import datetime
 
 class Reson7018Beam:
-    def __init__(self, size):
-        self.amplitude_samples = bytes()
-        self.phase_samples = bytes()
+    def __init__(self, amplitude_samples, phase_samples, size):
+        self.amplitude_samples = amplitude_samples
+        self.phase_samples = phase_samples
         self.number_of_samples = size
-        pass
 
     def get_amplitude_samples(self):
         return self.amplitude_samples
@@ -27,14 +24,11 @@ class Reson7018Wrapper:
     def __init__(self, packet):
         self.header = packet
         self.wcd = packet.record()
-        self.beams = []
-        for i in range(self.wcd.beams):
-            self.beams.append(Reson7018Beam(self.wcd.samples))
-        for sample in range(self.wcd.samples):
-            for beam in range(self.wcd.beams):
-                # Some oddness going on here because we need to get back from the numpy array (float64's) to the original sample format
-                self.beams[beam].amplitude_samples += struct.pack('H', int(self.wcd.amplitude[sample][beam]))
-                self.beams[beam].phase_samples += struct.pack('h', int(self.wcd.phase[sample][beam]))
+        # The record holds samples x beams matrices in the original uint16/int16 format, a single transpose gives us a contiguous
+        # row of samples per beam which GWF can take as is
+        amplitude = np.ascontiguousarray(self.wcd.amplitude.T)
+        phase = np.ascontiguousarray(self.wcd.phase.T)
+        self.beams = [Reson7018Beam(memoryview(amplitude[beam]).cast('B'), memoryview(phase[beam]).cast('B'), self.wcd.samples) for beam in range(self.wcd.beams)]
 
     def get_amplitude_sample_format(self):
         return 3
@@ -67,10 +61,16 @@ class Reson7008Beam:
         self.beam_index = beam_index
 
     def get_amplitude_samples(self):
-        return self.packet.beams[self.beam_index].amplitude
+        return self._as_bytes(self.packet.beams[self.beam_index].amplitude)
 
     def get_phase_samples(self):
-        return self.packet.beams[self.beam_index].phase
+        return self._as_bytes(self.packet.beams[self.beam_index].phase)
+
+    def _as_bytes(self, samples):
+        # Parsed beams hold numpy arrays, GWF expects a bytes-like object of which len() is the size in bytes
+        if isinstance(samples, bytes):
+            return samples
+        return memoryview(samples).cast('B')
 
     def get_number_of_amplitude_samples(self):
         return self.packet.numberOfSamplesInPing
@@ -110,11 +110,12 @@ class Reson7008Wrapper:
         return self.wcd.pingNumber
 
 class Reson7kParser:
+    water_column_record_types = {7008, 7018, 7042}
+
     def __init__(self):
         self.path = None
         self.parser = None
-        self.wc_generator = None
-        self.first_wc_packet = None
+        self.wc_index = None
 
         self.device_types = {
             20 	 : 'RESON SeaBat T20-P ',
@@ -154,45 +155,33 @@ class Reson7kParser:
 
     def Open(self, path):
         self.path = path
-        self.parser = S7kFrameReader(path)
+        # Only water column records are decoded, all other records are skipped over
+        self.parser = S7kFrameReader(path, record_types=self.water_column_record_types)
         self.parser.open()
-        self.wc_generator = (recordFrame for recordFrame in self.parser if recordFrame.recordTypeIdentifier in {7008, 7018, 7042})
+        index = self.parser.index()
+        self.wc_index = index[np.isin(index['record_type'], list(self.water_column_record_types))]
 
     def Close(self):
         self.parser.close()
         self.path = None
         self.parser = None
-        self.wc_generator = None
-        self.first_wc_packet = None
-
+        self.wc_index = None
 
     def ContainsWcd(self):
-        if self.first_wc_packet == None:
-            self._FindWcPacket()
+        if self.wc_index is None:
+            raise ValueError
 
-        return self.first_wc_packet != None
+        return len(self.wc_index) > 0
 
     def GetMakeAndModel(self):
-        if self.first_wc_packet == None:
-            self._FindWcPacket()
-
-        if self.first_wc_packet == None:
+        if not self.ContainsWcd():
             return ("None", "None")
 
-        if self.first_wc_packet.deviceIdentifier not in self.device_types:
-            return ("Reson", "Unknown {}".format(self.first_wc_packet.deviceIdentifier))
+        device = int(self.wc_index[0]['device'])
+        if device not in self.device_types:
+            return ("Reson", "Unknown {}".format(device))
 
-        return ("Reson", self.device_types[self.first_wc_packet.deviceIdentifier])
-
-    def _FindWcPacket(self):
-        if self.wc_generator == None:
-            raise ValueError
-
-        if self.first_wc_packet == None:
-            try:
-                self.first_wc_packet = next(self.wc_generator)
-            except StopIteration:
-                pass
+        return ("Reson", self.device_types[device])
 
     def wrap_wcd(self, record):
         if record.recordTypeIdentifier == 7018:
@@ -204,9 +193,7 @@ class Reson7kParser:
             return record
 
     def water_column_packets(self):
-        self.parser.close()
-        self.parser.open()
-        return (self.wrap_wcd(recordFrame) for recordFrame in self.parser if recordFrame.recordTypeIdentifier in {7008, 7018, 7042})
+        return (self.wrap_wcd(self.parser.read_frame(int(offset))) for offset in self.wc_index['offset'])
 
 # class reader_reson:
 #     def __init__(self):
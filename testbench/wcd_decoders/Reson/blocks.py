@@ -2,7 +2,6 @@ import struct
 import sys
 import uuid
 import math
-import os
 import datetime
 import calendar
 from numpy import *
@@ -18,7 +17,7 @@ class RecordFrame:
 
     """
 
-    def __init__(self, skip_data=False):
+    def __init__(self, skip_data=False, record_types=None):
         self.fin = None
         drfHeader = "<HHIIIIHHfBBxxIIxxHxxxxHxxxxxxII"
         self.headerStruct = struct.Struct(drfHeader)
@@ -53,12 +52,15 @@ class RecordFrame:
 
         # Book keepint
         self.skip_data = skip_data
+        self.record_types = record_types
         self.filePosition = None
+        self._record = None
 
     def read(self, fin):
         """ Read a Data Record Frame from fin """
         self.fin = fin
         self.filePosition = fin.tell()
+        self._record = None
         try:
             self.binary_data = fin.read(self.headerStruct.size)
             fields = self.headerStruct.unpack(self.binary_data)
@@ -87,7 +89,7 @@ class RecordFrame:
 
             # Load data
             bytesToRead = self.size - (self.headerStruct.size + self.checksumStruct.size)
-            if (not self.skip_data):
+            if not self.skips_data():
                 self.data = fin.read(bytesToRead)
             else:
                 curpos = fin.tell()
@@ -133,58 +135,29 @@ class RecordFrame:
         s.append(str(self.record()))
         return ''.join(s)
 
+    def skips_data(self):
+        """
+        True if the data of this frame is not read, either because all data is
+        skipped or because the record type is not in the set of record types
+        to decode.
+
+        """
+        return self.skip_data or (self.record_types is not None and self.recordTypeIdentifier not in self.record_types)
+
     def record(self):
         """
-        Return the record stored in this data frame.
+        Return the record stored in this data frame. The record is decoded on
+        the first call only.
 
         """
-        if (not self.skip_data):
-            # Data record was read into memory
-            if self.recordTypeIdentifier == SevenKGenericDataRecord.RECORD_TYPE_IDENTIFIER:
-                return SevenKGenericDataRecord(self.data)
-            elif self.recordTypeIdentifier == VerticalDepthRecord.RECORD_TYPE_IDENTIFIER:
-                return VerticalDepthRecord(self.data)
-            elif self.recordTypeIdentifier == AttitudeRecord.RECORD_TYPE_IDENTIFIER:
-                return AttitudeRecord(self.data)
-            elif self.recordTypeIdentifier == NavigationRecord.RECORD_TYPE_IDENTIFIER:
-                return NavigationRecord(self.data)
-            elif self.recordTypeIdentifier == DepthRecord.RECORD_TYPE_IDENTIFIER:
-                return DepthRecord(self.data)
-            elif self.recordTypeIdentifier == SnippetsDataRecord.RECORD_TYPE_IDENTIFIER:
-                return SnippetsDataRecord(self.data)
-            elif self.recordTypeIdentifier == BeamformedDataRecord.RECORD_TYPE_IDENTIFIER:
-                return BeamformedDataRecord(self.data)
-            elif self.recordTypeIdentifier == SevenKBackscatterImageryRecord.RECORD_TYPE_IDENTIFIER:
-                return SevenKBackscatterImageryRecord(self.data)
-            elif self.recordTypeIdentifier == RawBathymetryRecord.RECORD_TYPE_IDENTIFIER:
-                return RawBathymetryRecord(self.data)
-            elif self.recordTypeIdentifier == SevenKBathymetricDataRecord.RECORD_TYPE_IDENTIFIER:
-                return SevenKBathymetricDataRecord(self.data)
-            elif self.recordTypeIdentifier == SevenKBeamGeometryRecord.RECORD_TYPE_IDENTIFIER:
-                return SevenKBeamGeometryRecord(self.data)
-            elif self.recordTypeIdentifier == SevenKSonarSettingsRecord.RECORD_TYPE_IDENTIFIER:
-                return SevenKSonarSettingsRecord(self.data)
-            elif self.recordTypeIdentifier == HeadingRecord.RECORD_TYPE_IDENTIFIER:
-                return HeadingRecord(self.data)
-            elif self.recordTypeIdentifier == RollPitchHeaveRecord.RECORD_TYPE_IDENTIFIER:
-                return RollPitchHeaveRecord(self.data)
-            elif self.recordTypeIdentifier == PositionRecord.RECORD_TYPE_IDENTIFIER:
-                return PositionRecord(self.data)
-            elif self.recordTypeIdentifier == FileHeaderRecord.RECORD_TYPE_IDENTIFIER:
-                return FileHeaderRecord(self.data)
-            elif self.recordTypeIdentifier == SevenKConfigurationRecord.RECORD_TYPE_IDENTIFIER:
-                return SevenKConfigurationRecord(self.data)
-            elif self.recordTypeIdentifier == SevenKCenterVersionRecord.RECORD_TYPE_IDENTIFIER:
-                return SevenKCenterVersionRecord(self.data)
-            elif self.recordTypeIdentifier == CTDRecord.RECORD_TYPE_IDENTIFIER:
-                return CTDRecord(self.data)
-            elif self.recordTypeIdentifier == SonarInstallationParametersRecord.RECORD_TYPE_IDENTIFIER:
-                return SonarInstallationParametersRecord(self.data)
+        if self._record is None:
+            if not self.skips_data():
+                # Data record was read into memory
+                self._record = RECORD_TYPES.get(self.recordTypeIdentifier, UnknownRecord)(self.data)
             else:
-                return UnknownRecord(self.data)
-        else:
-            # Data record skipped
-            return SkippedDataRecord(self.recordTypeIdentifier, self.size)
+                # Data record skipped
+                self._record = SkippedDataRecord(self.recordTypeIdentifier, self.size)
+        return self._record
 
     def timeStamp(self):
         """ Returns the Unix timestamp of this frame """
@@ -228,48 +201,7 @@ class SkippedDataRecord:
         return "%s (%d bytes)\n" % (self.name, self.size)
 
     def getName(self, recordTypeIdentifier):
-        if recordTypeIdentifier == SevenKGenericDataRecord.RECORD_TYPE_IDENTIFIER:
-            return SevenKGenericDataRecord.NAME
-        elif recordTypeIdentifier == VerticalDepthRecord.RECORD_TYPE_IDENTIFIER:
-            return VerticalDepthRecord.NAME
-        elif recordTypeIdentifier == AttitudeRecord.RECORD_TYPE_IDENTIFIER:
-            return AttitudeRecord.NAME
-        elif recordTypeIdentifier == NavigationRecord.RECORD_TYPE_IDENTIFIER:
-            return NavigationRecord.NAME
-        elif recordTypeIdentifier == DepthRecord.RECORD_TYPE_IDENTIFIER:
-            return DepthRecord.NAME
-        elif recordTypeIdentifier == SnippetsDataRecord.RECORD_TYPE_IDENTIFIER:
-            return SnippetsDataRecord.NAME
-        elif recordTypeIdentifier == BeamformedDataRecord.RECORD_TYPE_IDENTIFIER:
-            return BeamformedDataRecord.NAME
-        elif recordTypeIdentifier == SevenKBackscatterImageryRecord.RECORD_TYPE_IDENTIFIER:
-            return SevenKBackscatterImageryRecord.NAME
-        elif recordTypeIdentifier == RawBathymetryRecord.RECORD_TYPE_IDENTIFIER:
-            return RawBathymetryRecord.NAME
-        elif recordTypeIdentifier == SevenKBathymetricDataRecord.RECORD_TYPE_IDENTIFIER:
-            return SevenKBathymetricDataRecord.NAME
-        elif recordTypeIdentifier == SevenKBeamGeometryRecord.RECORD_TYPE_IDENTIFIER:
-            return SevenKBeamGeometryRecord.NAME
-        elif recordTypeIdentifier == SevenKSonarSettingsRecord.RECORD_TYPE_IDENTIFIER:
-            return SevenKSonarSettingsRecord.NAME
-        elif recordTypeIdentifier == HeadingRecord.RECORD_TYPE_IDENTIFIER:
-            return HeadingRecord.NAME
-        elif recordTypeIdentifier == RollPitchHeaveRecord.RECORD_TYPE_IDENTIFIER:
-            return RollPitchHeaveRecord.NAME
-        elif recordTypeIdentifier == PositionRecord.RECORD_TYPE_IDENTIFIER:
-            return PositionRecord.NAME
-        elif recordTypeIdentifier == FileHeaderRecord.RECORD_TYPE_IDENTIFIER:
-            return FileHeaderRecord.NAME
-        elif recordTypeIdentifier == SevenKConfigurationRecord.RECORD_TYPE_IDENTIFIER:
-            return SevenKConfigurationRecord.NAME
-        elif recordTypeIdentifier == SevenKCenterVersionRecord.RECORD_TYPE_IDENTIFIER:
-            return SevenKCenterVersionRecord.NAME
-        elif recordTypeIdentifier == CTDRecord.RECORD_TYPE_IDENTIFIER:
-            return CTDRecord.NAME
-        elif recordTypeIdentifier == SonarInstallationParametersRecord.RECORD_TYPE_IDENTIFIER:
-            return SonarInstallationParametersRecord.NAME
-        else:
-            return UnknownRecord.NAME
+        return RECORD_TYPES.get(recordTypeIdentifier, UnknownRecord).NAME
 
 class UnknownRecord(Record):
     """
@@ -952,7 +884,7 @@ class SevenKGenericDataRecord(Record):
 
         beam_offset = struct.calcsize(fmt)
         for i in range(self.numberOfBeams):
-            beam = SevenKGenericWaterColumnDataBeam(self.data[beam_offset:])
+            beam = SevenKGenericWaterColumnDataBeam(self.data[beam_offset:beam_offset + struct.calcsize('<HII')])
             self.beams.append(beam)
             beam_offset += beam.size
 
@@ -991,39 +923,25 @@ class SevenKGenericDataRecord(Record):
 
 
 
-        for beam_index, beam in enumerate(self.beams):
+        for beam in self.beams:
             number_of_samples = beam.last_sample - beam.first_sample + 1
             assert number_of_samples == self.numberOfSamplesInPing, "If these two are not equal, I'm not sure this will work"
-            for sample_index in range(number_of_samples):
-                beam.amplitude += self._get_amplitude_sample(beam_index, sample_index)
-                beam.phase += self._get_phase_sample(beam_index, sample_index)
-
-    def _get_sample_offset(self, x_index, y_index, x_bound, sample_size):
-        return (y_index * x_bound + x_index) * (sample_size * 2)
-
-    def _get_amplitude_sample(self, beam, sample):
-        offset = 0
-        sample_size = struct.calcsize(self.amplitude_format)
 
+        # The sample data is a matrix of interleaved (amplitude, phase) pairs. Row column flag 0 stores it beam by beam, 1 stores
+        # it sample by sample. Either way we end up with one contiguous row of samples per beam.
         if self.rowColumnFlag == 0:
-            offset = self._get_sample_offset(sample, beam, self.numberOfSamplesInPing, sample_size)
+            shape = (self.numberOfBeams, self.numberOfSamplesInPing, 2)
         else:
-            offset = self._get_sample_offset(beam, sample, self.numberOfBeams, sample_size)
+            shape = (self.numberOfSamplesInPing, self.numberOfBeams, 2)
+        samples = frombuffer(self.sample_data, dtype='<' + self.amplitude_format, count=prod(shape)).reshape(shape)
+        if self.rowColumnFlag != 0:
+            samples = samples.transpose(1, 0, 2)
 
-        return self.sample_data[offset:offset+sample_size]
-
-    def _get_phase_sample(self, beam, sample):
-        sample_offset = 0
-        sample_size = struct.calcsize(self.phase_format)
-
-        if self.rowColumnFlag == 0:
-            offset = self._get_sample_offset(sample, beam, self.numberOfSamplesInPing, sample_size)
-        else:
-            offset = self._get_sample_offset(beam, sample, self.numberOfBeams, sample_size)
-
-        # offset by the size of the amplitude sample
-        offset = offset + struct.calcsize(self.amplitude_format)
-        return self.sample_data[offset:offset+sample_size]
+        amplitude = ascontiguousarray(samples[:, :, 0])
+        phase = ascontiguousarray(samples[:, :, 1]).view('<' + self.phase_format)
+        for beam_index, beam in enumerate(self.beams):
+            beam.amplitude = amplitude[beam_index]
+            beam.phase = phase[beam_index]
 
     def __str__(self):
         s = []
@@ -1101,20 +1019,14 @@ class BeamformedDataRecord(Record):
         self.amplitude = {}
         self.phase = {}
         start = struct.calcsize(fmt)
-        self.s = struct.Struct('<Hh')
         self.readBeamformedData(start, data)
 
     def readBeamformedData(self, start, data):
-
-        self.amplitude = zeros((self.samples, self.beams))
-        self.phase = zeros((self.samples, self.beams))
-        for sample in range(self.samples):
-            for beam in range(self.beams):
-                end = start + self.s.size
-                (amp, phase) = self.s.unpack(data[start:end])
-                self.amplitude[sample][beam] = amp
-                self.phase[sample][beam] = phase
-                start = end
+        # Samples x beams matrix of (uint16 amplitude, int16 phase) pairs. amplitude and phase are views on the record data
+        sample_dtype = dtype([('amplitude', '<u2'), ('phase', '<i2')])
+        samples = frombuffer(data, dtype=sample_dtype, count=self.samples * self.beams, offset=start).reshape((self.samples, self.beams))
+        self.amplitude = samples['amplitude']
+        self.phase = samples['phase']
 
     def __str__(self):
         s = []
@@ -1414,4 +1326,25 @@ class FileHeaderRecord(Record):
         s.append("User Defined Name: %s\n" % self.userDefinedName)
         return ''.join(s)
 
-
+# Record classes by record type identifier
+RECORD_TYPES = {record.RECORD_TYPE_IDENTIFIER: record for record in [
+    SevenKGenericDataRecord,
+    VerticalDepthRecord,
+    AttitudeRecord,
+    NavigationRecord,
+    DepthRecord,
+    SnippetsDataRecord,
+    BeamformedDataRecord,
+    SevenKBackscatterImageryRecord,
+    RawBathymetryRecord,
+    SevenKBathymetricDataRecord,
+    SevenKBeamGeometryRecord,
+    SevenKSonarSettingsRecord,
+    HeadingRecord,
+    RollPitchHeaveRecord,
+    PositionRecord,
+    FileHeaderRecord,
+    SevenKConfigurationRecord,
+    SevenKCenterVersionRecord,
+    CTDRecord,
+    SonarInstallationParametersRecord]}
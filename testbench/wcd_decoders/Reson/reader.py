@@ -1,5 +1,14 @@
 from . import blocks
-import struct, os, sys
+from .. import sidecar_index
+import struct, os, sys, mmap, calendar, logging
+import numpy as np
+
+# One entry per record frame in an s7k file. time is the frame time stamp in seconds since the epoch
+s7k_index_dtype = np.dtype([('offset', '<u8'),
+                            ('size', '<u4'),
+                            ('record_type', '<u4'),
+                            ('device', '<u4'),
+                            ('time', '<f8')])
 
 class S7kFrameReader:
     """
@@ -7,14 +16,16 @@ class S7kFrameReader:
 
     """
 
-    def __init__(self, filename, skip_data=False):
+    def __init__(self, filename, skip_data=False, record_types=None):
         self.filename = filename
         self.fin = None
         self.size = None
         self.bytesRead = 0
         self.framesRead = 0
-        self.recordFrame = blocks.RecordFrame(skip_data)
+        self.recordFrame = blocks.RecordFrame(skip_data, record_types)
         self.skip_data = skip_data
+        self.record_types = record_types
+        self._index = None
 
     def open(self):
         try:
@@ -23,6 +34,8 @@ class S7kFrameReader:
             print >> sys.stderr, "s7kfile.S7kFile.open(): errror: %s\n" % e
             sys.exit(1)
         self.size = os.path.getsize(self.filename)
+        self.bytesRead = 0
+        self.framesRead = 0
 
     def close(self):
         self.fin.close()
@@ -31,10 +44,10 @@ class S7kFrameReader:
         return self
 
     def __next__(self):
-        if self.bytesRead >= os.path.getsize(self.filename):
+        if self.bytesRead >= self.size:
             raise StopIteration
 
-        frame = blocks.RecordFrame(self.skip_data)
+        frame = blocks.RecordFrame(self.skip_data, self.record_types)
         try:
             frame.read(self.fin)
         except IOError:
@@ -52,3 +65,51 @@ class S7kFrameReader:
         self.fin.seek(0)
         self.bytesRead = 0
         self.framesRead = 0
+
+    index_extension = '.s7kidx'
+
+    def index(self):
+        """
+        Returns the frame index of the file, an array of s7k_index_dtype. The
+        index is stored next to the file, so it is only built once.
+
+        """
+        if self._index is None:
+            self._index = sidecar_index.load_or_build(self.filename, self.index_extension, b'S7KI', s7k_index_dtype, self._build_index)
+        return self._index
+
+    def read_frame(self, offset):
+        """ Read the frame starting at offset """
+        self.fin.seek(offset)
+        frame = blocks.RecordFrame(self.skip_data, self.record_types)
+        frame.read(self.fin)
+        return frame
+
+    def frames(self, record_types):
+        """ Generator of the frames with a record type in record_types, using the index to skip all other frames """
+        index = self.index()
+        for offset in index['offset'][np.isin(index['record_type'], list(record_types))]:
+            yield self.read_frame(int(offset))
+
+    def _build_index(self):
+        header = struct.Struct(blocks.RecordFrame().headerStruct.format)
+        entries = []
+        with open(self.filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return entries
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                offset = 0
+                while offset + header.size <= size:
+                    fields = header.unpack_from(buffer, offset)
+                    frame_size = fields[3]
+                    if frame_size == 0:
+                        break
+                    if offset + frame_size > size:
+                        logging.error('Truncated frame at offset {} in {}'.format(offset, self.filename))
+                        break
+                    year, day, second, hour, minute = fields[6:11]
+                    time = calendar.timegm((year, 1, 1, hour, minute, 0)) + (day - 1) * 86400 + second
+                    entries.append((offset, frame_size, fields[11], fields[12], time))
+                    offset += frame_size
+        return entries
@@ -0,0 +1,115 @@
+'''Convert directories of raw water column files (.s7k, .all, ...) to GWF, one file per worker process'''
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+import gwf
+from .ParserCollection import WcdParserCollection
+
+conversion_result = namedtuple('conversion_result', 'input_path output_path input_size pings seconds status')
+
+partial_extension = '.part'
+
+# Every worker process gets its own parser collection, parsers keep the file they are working on open
+_parser_collection = None
+
+def _init_worker():
+    global _parser_collection
+    _parser_collection = WcdParserCollection()
+
+def find_input_files(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    parsers = WcdParserCollection()
+    return sorted(path for path in paths if os.path.isfile(path) and parsers.IsPotentialWcdFile(path))
+
+def output_path_for(input_path, output_directory):
+    name = os.path.splitext(os.path.split(input_path)[1])[0]
+    return os.path.join(output_directory, name + '.gwf')
+
+def convert(source, output_directory, processes=None):
+    '''
+    Convert every water column file matched by source (a directory or a glob pattern) to GWF in output_directory.
+    Files are written under a temporary name and renamed when complete, so an interrupted run can simply be restarted:
+    files that were converted before are skipped, partially converted files are converted again.
+    '''
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    tasks = []
+    results = []
+    for input_path in find_input_files(source):
+        output_path = output_path_for(input_path, output_directory)
+        if os.path.exists(output_path):
+            logging.info('Skipping {}, already converted to {}'.format(input_path, output_path))
+            results.append(conversion_result(input_path, output_path, os.path.getsize(input_path), None, 0, 'done before'))
+        else:
+            tasks.append((input_path, output_path))
+
+    # Largest files first so a big file does not end up as the single task running at the end
+    tasks.sort(key=lambda task: os.path.getsize(task[0]), reverse=True)
+
+    start = time.perf_counter()
+    with Pool(processes or cpu_count(), initializer=_init_worker) as pool:
+        for result in pool.imap_unordered(_convert_file, tasks):
+            _log_result(result)
+            results.append(result)
+
+    converted = [result for result in results if result.status == 'converted']
+    seconds = time.perf_counter() - start
+    if converted and seconds > 0:
+        logging.info('Converted {} files, {:.1f} MB in {:.1f} seconds ({:.1f} MB/s)'.format(len(converted), sum(result.input_size for result in converted) / 1024**2, seconds, sum(result.input_size for result in converted) / 1024**2 / seconds))
+    return results
+
+def _convert_file(task):
+    input_path, output_path = task
+    partial_path = output_path + partial_extension
+    input_size = os.path.getsize(input_path)
+    start = time.perf_counter()
+    pings = 0
+    try:
+        if not _parser_collection.ContainsWcd(input_path):
+            return conversion_result(input_path, output_path, input_size, 0, time.perf_counter() - start, 'no water column data')
+
+        with gwf.Writer(partial_path) as writer:
+            for ping in _parser_collection.Water_column_packets(input_path):
+                writer.write(ping)
+                pings += 1
+
+        os.replace(partial_path + gwf.File.index_extension, output_path + gwf.File.index_extension)
+        os.replace(partial_path, output_path)
+        return conversion_result(input_path, output_path, input_size, pings, time.perf_counter() - start, 'converted')
+    except Exception as e:
+        logging.exception('Conversion of {} failed'.format(input_path))
+        for path in (partial_path, partial_path + gwf.File.index_extension):
+            if os.path.exists(path):
+                os.remove(path)
+        return conversion_result(input_path, output_path, input_size, pings, time.perf_counter() - start, 'failed: {}'.format(e))
+    finally:
+        if _parser_collection.opened_file != None:
+            _parser_collection.Close()
+
+def _log_result(result):
+    if result.status != 'converted':
+        logging.info('{}: {}'.format(result.input_path, result.status))
+        return
+
+    seconds = max(result.seconds, 1E-9)
+    logging.info('{}: {} pings, {:.1f} MB in {:.1f} seconds ({:.1f} MB/s, {:.1f} pings/s)'.format(result.input_path, result.pings, result.input_size / 1024**2, result.seconds, result.input_size / 1024**2 / seconds, result.pings / seconds))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert raw water column files to the generic water column format')
+    parser.add_argument('source', help='Directory or glob pattern of the files to convert')
+    parser.add_argument('output_directory', help='Directory to write the GWF files to')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='Number of worker processes (default: number of cores)')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    results = convert(arguments.source, arguments.output_directory, arguments.processes)
+    sys.exit(1 if any(result.status.startswith('failed') for result in results) else 0)
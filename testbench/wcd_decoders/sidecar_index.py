@@ -0,0 +1,41 @@
+'''Indices of the records in a raw water column file, stored in a file next to it.
+An index is only used as long as the size and modification time of the indexed file match the ones it was built for and it
+holds as many entries as its header says.'''
+import os
+import struct
+import logging
+import numpy as np
+import gwf
+
+_header_format = '<4sIQQQ' # magic, version, size of the indexed file, modification time of the indexed file (ns), number of entries
+
+def load_or_build(path, extension, magic, dtype, build, version=2):
+    '''Return the index (a numpy array of dtype) of the file at path. build is called to create it when there is no valid stored index'''
+    entries = load(path, extension, magic, dtype, version)
+    if entries is None:
+        entries = np.array(build(), dtype=dtype)
+        save(path, extension, magic, entries, version)
+    return entries
+
+def load(path, extension, magic, dtype, version=2):
+    stat = os.stat(path)
+    try:
+        with open(path + extension, 'rb') as f:
+            header = struct.unpack(_header_format, f.read(struct.calcsize(_header_format)))
+            if header[:4] != (magic, version, stat.st_size, stat.st_mtime_ns):
+                return None
+            data = f.read()
+            # A save that was cut short leaves fewer entries than the header announces
+            if len(data) != header[4] * np.dtype(dtype).itemsize:
+                return None
+            return np.frombuffer(data, dtype=dtype)
+    except (OSError, struct.error, ValueError):
+        return None
+
+def save(path, extension, magic, entries, version=2):
+    stat = os.stat(path)
+    try:
+        gwf.write_atomically(path + extension, [struct.pack(_header_format, magic, version, stat.st_size, stat.st_mtime_ns, len(entries)), entries.tobytes()])
+    except OSError as e:
+        # Not being able to store the index (e.g. read-only data directory) only costs us a rebuild next time
+        logging.debug('Could not store index for {}: {}'.format(path, e))